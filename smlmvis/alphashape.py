@@ -0,0 +1,130 @@
+import numpy as np
+import logging
+from scipy.spatial import Delaunay, QhullError
+from smlmvis.parallel import process_pool, to_shared, from_shared
+logger = logging.getLogger('global')
+
+# Tiles take the points up to alpha beyond their bounds,
+# widened a little for rounding in the circumcenters
+_HALO_MARGIN = 1e-6
+
+
+def circumspheres(points, tetras):
+    '''
+    :param points: N x 3 array
+    :param tetras: M x 4 integer array of indices into points
+    :return: (M x 3 centers, M radii) of the spheres through the vertices of each tetrahedron,
+        radius inf if it is flat
+    '''
+    tetras = np.asarray(tetras)
+    a = points[tetras[:, 0]].astype(np.float64)
+    u, v, w = (points[tetras[:, k]] - a for k in (1, 2, 3))
+    vw, wu, uv = np.cross(v, w), np.cross(w, u), np.cross(u, v)
+    offsets = np.einsum('ij,ij->i', u, u)[:, None] * vw \
+        + np.einsum('ij,ij->i', v, v)[:, None] * wu \
+        + np.einsum('ij,ij->i', w, w)[:, None] * uv
+    with np.errstate(divide='ignore', invalid='ignore'):
+        offsets /= 2 * np.einsum('ij,ij->i', u, vw)[:, None]
+        radii = np.sqrt(np.einsum('ij,ij->i', offsets, offsets))
+    radii[~np.isfinite(radii)] = np.inf
+    return a + offsets, radii
+
+
+def _tile_complex(points, alpha, lo, hi):
+    '''
+    :param points: the points of a tile and its halo
+    :param lo: lower bounds of the tile core, inclusive
+    :param hi: upper bounds of the tile core, exclusive
+    :return: (local tetras, radii) with circumradius <= alpha and circumcenter in the core
+    '''
+    if len(points) < 4:
+        return np.empty((0, 4), dtype=np.int64), np.empty(0)
+    try:
+        tetras = Delaunay(points).simplices
+    except QhullError as e:
+        logger.warning('Skipping a tile of {} points that can not be triangulated: {}'.format(
+            len(points), e))
+        return np.empty((0, 4), dtype=np.int64), np.empty(0)
+    centers, radii = circumspheres(points, tetras)
+    keep = (radii <= alpha) & np.all((centers >= lo) & (centers < hi), axis=1)
+    return tetras[keep].astype(np.int64), radii[keep]
+
+
+def _shared_tile(points, index, alpha, lo, hi):
+    index = from_shared(index)
+    tetras, radii = _tile_complex(from_shared(points), alpha, lo, hi)
+    return to_shared(index[tetras]), to_shared(radii)
+
+
+def _tiles(points, alpha, tile_size):
+    '''
+    Split space in cubes of tile_size over the bounding box of points,
+    the outer tiles extend to infinity.
+    :return: generator of (indices of the points of the tile and its halo,
+        lower bounds, upper bounds)
+    '''
+    mins = points.min(axis=0)
+    counts = np.maximum(1, np.ceil(np.ptp(points, axis=0) / tile_size).astype(np.int64))
+    edges = []
+    for axis in range(3):
+        bounds = mins[axis] + tile_size * np.arange(counts[axis] + 1, dtype=np.float64)
+        bounds[0], bounds[-1] = -np.inf, np.inf
+        edges.append(bounds)
+    halo = alpha * (1 + _HALO_MARGIN)
+    order = np.argsort(points[:, 0], kind='stable')
+    xs = points[order, 0]
+    for i in range(counts[0]):
+        first = np.searchsorted(xs, edges[0][i] - halo)
+        slab = order[first:np.searchsorted(xs, edges[0][i + 1] + halo, side='right')]
+        for j in range(counts[1]):
+            for k in range(counts[2]):
+                lo = np.array([edges[0][i], edges[1][j], edges[2][k]])
+                hi = np.array([edges[0][i + 1], edges[1][j + 1], edges[2][k + 1]])
+                yz = points[slab, 1:]
+                inside = np.all((yz >= lo[1:] - halo) & (yz <= hi[1:] + halo), axis=1)
+                yield slab[inside], lo, hi
+
+
+def alpha_complex(points, alpha, tile_size=None, max_workers=1):
+    '''
+    The tetrahedra of the Delaunay triangulation of points with a circumradius <= alpha,
+    as arrays that TetraMeshWriter and AlphaGraphWriter take directly:
+        tetras, radii = alpha_complex(reader.points, 50)
+        AlphaGraphWriter('alpha', reader.points, values, tetras,
+                         cell_data=[('circumradius', radii)])
+    :param points: N x 3 array
+    :param alpha: largest circumradius kept
+    :param tile_size: If given, space is cut in cubes of this size that are triangulated separately,
+        each with the points up to alpha around it (halo), which bounds memory use for large clouds.
+        A tetrahedron is kept by the tile that holds its circumcenter. Its circumsphere then lies in
+        the tile and halo, so the result is the same as without tiles.
+        Tiles should be several times larger than alpha.
+    :param max_workers: Number of processes triangulating tiles, None for the number of cores.
+        1 works in this process.
+    :return: (M x 4 int64 array of indices into points, M circumradii)
+    '''
+    if alpha <= 0:
+        raise ValueError('Alpha should be > 0, not {}'.format(alpha))
+    if tile_size is not None and tile_size <= 0:
+        raise ValueError('Tile size should be > 0, not {}'.format(tile_size))
+    points = np.asarray(points, dtype=np.float64)
+    if tile_size is None:
+        everywhere = np.full(3, np.inf)
+        return _tile_complex(points, alpha, -everywhere, everywhere)
+    tiles = [tile for tile in _tiles(points, alpha, tile_size) if len(tile[0]) >= 4]
+    if max_workers == 1:
+        results = []
+        for index, lo, hi in tiles:
+            tetras, radii = _tile_complex(points[index], alpha, lo, hi)
+            results.append((index[tetras], radii))
+    else:
+        with process_pool(max_workers) as pool:
+            futures = [pool.submit(_shared_tile, to_shared(points[index]), to_shared(index), alpha,
+                                   lo, hi)
+                       for index, lo, hi in tiles]
+            results = [tuple(from_shared(handle) for handle in future.result())
+                       for future in futures]
+    if not results:
+        return np.empty((0, 4), dtype=np.int64), np.empty(0)
+    tetras, radii = zip(*results)
+    return np.concatenate(tetras), np.concatenate(radii)
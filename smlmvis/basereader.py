@@ -0,0 +1,212 @@
+import logging
+from smlmvis.cache import DecodeCache
+from smlmvis.columnstore import ColumnStore
+from smlmvis.query import Query
+from smlmvis.frameindex import FrameIndex, index_key
+logger = logging.getLogger('global')
+
+
+class BaseReader(object):
+    '''
+    Accessors shared by all readers.
+    Subclasses implement _read(), which decodes the whole file into self._points (N x 3) and
+    self._values (N x k), and _read_chunks(chunk_size), which yields the same layout block by block
+    straight from disk.
+    _column_dtypes maps names of value columns that hold integers (frames, ids) to their type for
+    compact storage.
+    _frame_column is the name of the value column with the frame number.
+    '''
+    _column_dtypes = {}
+    _frame_column = None
+
+    def __init__(self, filename, lazy=False, cache=None, compact=False):
+        '''
+        :param filename: Path to file
+        :param lazy: If true, nothing is decoded until points or values are used.
+            Use this with iter_chunks to process files that don't fit in memory.
+        :param cache: If true, decoded arrays are kept in the default DecodeCache and memory mapped
+            from there the next time the same file is read with the same parameters.
+            A DecodeCache instance selects another location or size.
+        :param compact: If true, keep coordinates as float32 and each value column in its own typed
+            array (integers for frames and ids, float32 otherwise), see column(). values then
+            assembles a float64 copy on first access and keeps it, use column() to keep the memory
+            saving.
+        '''
+        self._filename = filename
+        self._points = None
+        self._values = None
+        self._store = None
+        self._frame_index = None
+        self._loaded = False
+        self._compact = compact
+        self._cache = DecodeCache() if cache is True else (cache or None)
+        if not lazy:
+            self._load()
+
+    def _load(self):
+        if not self._loaded:
+            self._loaded = True
+            if self._cache is None:
+                self._read()
+                self._compact_columns()
+                return
+            key = self._cache.key(self._filename, self._cache_params())
+            state = self._cache.load(key)
+            if state is None:
+                self._read()
+                self._compact_columns()
+                state = self._get_state()
+                if state is not None:
+                    self._cache.store(key, state)
+            else:
+                self._set_state(state)
+
+    def _compact_columns(self):
+        if self._compact and self._points is not None:
+            self._store = ColumnStore.from_arrays(self._points, self._values, self._value_names(),
+                                                  self._column_dtypes)
+            self._points, self._values = self._store.points, None
+
+    def _value_names(self):
+        '''
+        :return: names of the columns of values, in order
+        '''
+        return self._columns
+
+    def _cache_params(self):
+        '''
+        :return: dict of the parameters that change the decoded arrays, part of the cache key
+        '''
+        return {'reader': type(self).__name__, 'compact': self._compact}
+
+    def _get_state(self):
+        if self._points is None:
+            return None
+        if self._store is not None:
+            state = {'column{}'.format(i): self._store[name]
+                     for i, name in enumerate(self._store.names)}
+            state['points'] = self._points
+            return state
+        return {'points': self._points, 'values': self._values}
+
+    def _set_state(self, state):
+        self._points = state['points']
+        if 'values' in state:
+            self._values = state['values']
+        else:
+            columns = [(name, state['column{}'.format(i)])
+                       for i, name in enumerate(self._value_names())]
+            self._store = ColumnStore(self._points, columns)
+
+    def _read(self):
+        raise NotImplementedError
+
+    def _read_chunks(self, chunk_size):
+        raise NotImplementedError
+
+    @property
+    def points(self):
+        self._load()
+        return self._points
+
+    @property
+    def values(self):
+        self._load()
+        if self._values is None and self._store is not None:
+            self._values = self._store.values()
+        return self._values
+
+    def column(self, name):
+        '''
+        :param name: Name of a column in value_names
+        :return: 1D array of that column, in its compact type if the reader is compact
+        '''
+        self._load()
+        if self._store is not None:
+            return self._store[name]
+        return self._values[:, self._value_names().index(name)]
+
+    @property
+    def value_names(self):
+        return self._columns
+
+    @property
+    def value_columns(self):
+        '''
+        Names of the columns of values, in order.
+        Unlike value_names this never includes the coordinates.
+        '''
+        return self._value_names()
+
+    def point_data(self, columns=None):
+        '''
+        :param columns: names of the columns to include, defaults to all value_columns
+        :return: list of (name, column), the point_data of the writers in vtuwriter.
+            Columns of a compact reader are passed in their own type, without a copy.
+        '''
+        return [(name, self.column(name)) for name in (columns or self.value_columns)]
+
+    def points_generator(self):
+        for point in self.points:
+            yield point
+
+    def values_generator(self):
+        for value in self.values:
+            yield value
+
+    def frame_index(self, persist=False):
+        '''
+        Build (once) the index used by frames().
+        :param persist: If true, save the index next to the file as <filename>.frameindex.npz,
+            and reuse it as long as the file and the reader parameters are unchanged.
+        :return: FrameIndex
+        '''
+        if self._frame_index is None:
+            if self._frame_column not in self._value_names():
+                raise ValueError('No frame column {} in {}'.format(self._frame_column,
+                                                                   self._value_names()))
+            sidecar = self._filename + '.frameindex.npz'
+            key = index_key(self._filename, self._cache_params()) if persist else ''
+            if persist:
+                self._frame_index = FrameIndex.load(sidecar, key)
+            if self._frame_index is None:
+                self._frame_index = FrameIndex.build(self.column(self._frame_column))
+                if persist:
+                    self._frame_index.save(sidecar, key)
+        return self._frame_index
+
+    def frames(self, start, stop):
+        '''
+        :return: points, values of the localizations with start <= frame < stop.
+            For frame sorted data these are views, found with a binary search.
+        '''
+        return self._select(self.frame_index().rows(start, stop))
+
+    def _select(self, rows):
+        self._load()
+        if self._store is not None:
+            return self._points[rows], self._store.values(rows)
+        return self._points[rows], self._values[rows]
+
+    def query(self):
+        '''
+        :return: Query on points, values, to chain filters that are evaluated in one pass.
+            A compact reader is queried on its columns, without assembling values.
+        '''
+        points = self.points
+        return Query(points, self.values if self._store is None else self._store, self.value_names)
+
+    def iter_chunks(self, chunk_size=1000000):
+        '''
+        Stream the file as (points, values) blocks,
+        read from disk independent of what is loaded in memory.
+        Blocks have the layout of points and values, with the same preprocessing applied.
+        :param chunk_size: Number of rows read per block,
+            blocks can be shorter if rows are filtered out.
+        :return: generator of (points, values) numpy arrays
+        '''
+        if chunk_size < 1:
+            raise ValueError('Chunk size should be >= 1, not {}'.format(chunk_size))
+        for points, values in self._read_chunks(chunk_size):
+            if len(points):
+                yield points, values
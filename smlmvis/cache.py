@@ -0,0 +1,113 @@
+import os
+import json
+import shutil
+import hashlib
+import uuid
+import numpy as np
+import logging
+logger = logging.getLogger('global')
+
+
+def default_directory():
+    return os.path.join(os.path.expanduser('~'), '.cache', 'smlmvis')
+
+
+class DecodeCache(object):
+    '''
+    On disk cache of decoded reader arrays.
+    Each entry is a directory of .npy files, keyed on the path, size and modification time of the
+    source file and the parameters of the reader. Hits are memory mapped (copy on write), so opening
+    a cached file costs almost nothing. If the entries take more than max_bytes, the least recently
+    used ones are removed.
+    '''
+    def __init__(self, directory=None, max_bytes=10 << 30):
+        '''
+        :param directory: Where entries are stored, defaults to ~/.cache/smlmvis
+        :param max_bytes: Size cap of the cache in bytes
+        '''
+        self._directory = directory or default_directory()
+        self._max_bytes = max_bytes
+        os.makedirs(self._directory, exist_ok=True)
+
+    @property
+    def directory(self):
+        return self._directory
+
+    def key(self, filename, params):
+        '''
+        :param filename: Path of the decoded file
+        :param params: dict of reader parameters that change the decoded result
+        :return: hex string identifying this decode of this version of the file
+        '''
+        st = os.stat(filename)
+        ident = [os.path.abspath(filename), st.st_size, st.st_mtime_ns, params]
+        return hashlib.sha1(json.dumps(ident, sort_keys=True).encode()).hexdigest()
+
+    def load(self, key):
+        '''
+        :return: dict of name -> array memory mapped from the entry, None on a miss
+        '''
+        path = os.path.join(self._directory, key)
+        if not os.path.isdir(path):
+            return None
+        try:
+            arrays = {name[:-4]: np.load(os.path.join(path, name), mmap_mode='c')
+                      for name in os.listdir(path) if name.endswith('.npy')}
+            os.utime(path)
+        except (OSError, ValueError) as e:
+            logger.warning('Ignoring unreadable cache entry {} : {}'.format(path, e))
+            return None
+        logger.debug('Cache hit {}'.format(path))
+        return arrays
+
+    def store(self, key, arrays):
+        '''
+        Save arrays under key, then evict entries until the cache fits in max_bytes.
+        :param arrays: dict of name -> numpy array
+        '''
+        nbytes = sum(a.nbytes for a in arrays.values())
+        if nbytes > self._max_bytes:
+            logger.info('Not caching {} bytes, exceeds cache size {}'.format(
+                nbytes, self._max_bytes))
+            return
+        path = os.path.join(self._directory, key)
+        tmp = os.path.join(self._directory, 'tmp-{}'.format(uuid.uuid4().hex))
+        os.makedirs(tmp)
+        try:
+            for name, array in arrays.items():
+                np.save(os.path.join(tmp, name + '.npy'), array)
+            os.rename(tmp, path)
+        except OSError:
+            # Another process stored the same entry first
+            shutil.rmtree(tmp, ignore_errors=True)
+        self.evict()
+
+    def entries(self):
+        '''
+        :return: list of (last used time, size in bytes, path), oldest first
+        '''
+        result = []
+        for name in os.listdir(self._directory):
+            path = os.path.join(self._directory, name)
+            if name.startswith('tmp-') or not os.path.isdir(path):
+                continue
+            try:
+                size = sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path))
+                result.append((os.path.getmtime(path), size, path))
+            except OSError:
+                continue
+        return sorted(result)
+
+    def evict(self):
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self._max_bytes:
+                break
+            logger.debug('Evicting cache entry {}'.format(path))
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+
+    def clear(self):
+        for _, _, path in self.entries():
+            shutil.rmtree(path, ignore_errors=True)
@@ -0,0 +1,80 @@
+import numpy as np
+import logging
+logger = logging.getLogger('global')
+
+
+def compact_column(name, column, dtype=None):
+    '''
+    :param name: column name, for logging
+    :param column: 1D array
+    :param dtype: preferred integer type, the column is only converted if it holds exactly
+    :return: column as dtype, or as float32 if no dtype is given
+    '''
+    if dtype is None or np.dtype(dtype).kind == 'f':
+        return column.astype(np.float32)
+    typed = column.astype(dtype)
+    if np.array_equal(typed, column):
+        return typed
+    logger.warning('Column {} does not fit in {}, keeping {}'.format(name, np.dtype(dtype).name,
+                                                                    column.dtype.name))
+    return column.copy()
+
+
+class ColumnStore(object):
+    '''
+    Localizations as coordinates plus one typed array per value column,
+    instead of a single float64 values matrix.
+    Frame numbers and ids are kept as integers, everything else as float32.
+    '''
+    def __init__(self, points, columns):
+        '''
+        :param points: N x 3 array of coordinates
+        :param columns: list of (name, 1D array of length N)
+        '''
+        self._points = points
+        self._names = [name for name, _ in columns]
+        self._columns = dict(columns)
+
+    @classmethod
+    def from_arrays(cls, points, values, names, dtypes=None, coord_dtype=np.float32):
+        '''
+        :param points: N x 3 array
+        :param values: N x k array
+        :param names: names of the k columns of values
+        :param dtypes: dict of name -> integer dtype for columns that hold ids or counts
+        :param coord_dtype: dtype of the coordinates
+        '''
+        dtypes = dtypes or {}
+        columns = [(name, compact_column(name, values[:, i], dtypes.get(name)))
+                   for i, name in enumerate(names)]
+        return cls(np.ascontiguousarray(points, dtype=coord_dtype), columns)
+
+    @property
+    def points(self):
+        return self._points
+
+    @property
+    def names(self):
+        return self._names
+
+    @property
+    def nbytes(self):
+        return self._points.nbytes + sum(c.nbytes for c in self._columns.values())
+
+    def __getitem__(self, name):
+        return self._columns[name]
+
+    def __len__(self):
+        return len(self._points)
+
+    def values(self, rows=None, dtype=np.float64):
+        '''
+        :param rows: slice or index array to assemble only these rows
+        :return: a new array with all columns, in the layout of reader.values
+        '''
+        if rows is None:
+            rows = slice(None)
+        result = np.empty((len(self._points[rows]), len(self._names)), dtype=dtype)
+        for i, name in enumerate(self._names):
+            result[:, i] = self._columns[name][rows]
+        return result
@@ -0,0 +1,79 @@
+import numpy as np
+import pandas as pd
+import logging
+from smlmvis.basereader import BaseReader
+logger = logging.getLogger('global')
+
+
+class CSVReader(BaseReader):
+    '''
+    Base of the readers of CSV exports.
+    Only the coordinate columns and the requested value columns are parsed, with a declared float64
+    type, and copied column by column into points and values without intermediate frames.
+    Subclasses set _coordinates (x, y, z column names) and either _columns (value columns)
+    or override _header_columns to derive them from the header.
+    '''
+    _coordinates = []
+    _extra = []
+
+    def __init__(self, filename, lazy=False, cache=None, compact=False, columns=None, engine='c'):
+        '''
+        :param filename: Path to file
+        :param lazy: If true, defer decoding until points or values are used
+        :param cache: True or a DecodeCache to reuse decoded arrays across sessions
+        :param compact: If true, store ids and frames as integers and the rest as float32
+        :param columns: Value columns to load, in this order. Defaults to all of them,
+            other columns are not parsed.
+        :param engine: pandas CSV parser, 'c' or 'pyarrow' (multithreaded, needs pyarrow).
+            Chunked reads always use 'c'.
+        '''
+        self._header = list(pd.read_csv(filename, nrows=0).columns)
+        self._columns = self._header_columns(self._header)
+        if columns is not None:
+            missing = [c for c in columns if c not in self._columns]
+            if missing:
+                raise ValueError('Unknown columns {} in {}, available are {}'.format(
+                    missing, filename, self._columns))
+            self._columns = list(columns)
+        self._engine = engine
+        super().__init__(filename, lazy, cache, compact)
+
+    def _header_columns(self, header):
+        '''
+        :param header: column names of the file
+        :return: all value columns
+        '''
+        return self._columns
+
+    def _cache_params(self):
+        params = super()._cache_params()
+        params['columns'] = self._columns
+        # The C and pyarrow parsers do not round floats the same way
+        params['engine'] = self._engine
+        return params
+
+    def _read_csv(self, **kwargs):
+        wanted = set(self._coordinates + self._columns + self._extra)
+        usecols = [c for c in self._header if c in wanted]
+        return pd.read_csv(self._filename, usecols=usecols, dtype={c: np.float64 for c in usecols},
+                           **kwargs)
+
+    def _read(self):
+        self._points, self._values = self._split(self._read_csv(engine=self._engine))
+
+    def _read_chunks(self, chunk_size):
+        for data in self._read_csv(chunksize=chunk_size):
+            yield self._split(data)
+
+    def _split(self, data):
+        points = np.empty((len(data), 3))
+        for i, name in enumerate(self._coordinates):
+            if i == 2 and name not in data.columns:
+                # 2D localizations
+                points[:, i] = 0
+            else:
+                points[:, i] = data[name].to_numpy()
+        values = np.empty((len(data), len(self._columns)))
+        for i, name in enumerate(self._columns):
+            values[:, i] = data[name].to_numpy()
+        return points, values
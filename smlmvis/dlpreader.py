@@ -1,42 +1,31 @@
 import numpy as np
+from itertools import islice
+from smlmvis.basereader import BaseReader
 
-class DlpReader(object):
+
+class DlpReader(BaseReader):
     ''' Read a .3dlp file into memory'''
-    def __init__(self, filename):
-        self._filename = filename
-        self._values = None
-        self._points = None
+    _column_dtypes = {'framenumber': np.uint32}
+    _frame_column = 'framenumber'
+
+    def __init__(self, filename, lazy=False, cache=None, compact=False):
         self._columns = ['std_x', 'std_y', 'std_z', 'amplitude', 'framenumber']
-        self._read()
+        super().__init__(filename, lazy, cache, compact)
 
     def _read(self):
         A = np.loadtxt(self._filename)
         self._points = A[:,0:3] # X Y Z
         self._values = A[:,3:] # remainder
 
-    @property
-    def points(self):
-        return self._points
-
-    @property
-    def values(self):
-        return self._values
-
-    @property
-    def value_names(self):
-        return self._columns
-
-    def points_generator(self):
-        cnt = 0
-        l = len(self.points)
-        while cnt < l:
-            yield self._points[cnt]
-
-    def values_generator(self):
-        cnt = 0
-        l = len(self.values)
-        while cnt < l:
-            yield self._values[cnt]
+    def _read_chunks(self, chunk_size):
+        with open(self._filename) as f:
+            while True:
+                lines = list(islice(f, chunk_size))
+                if not lines:
+                    return
+                A = np.loadtxt(lines, ndmin=2)
+                if A.size:
+                    yield A[:, 0:3], A[:, 3:]
 
 if __name__=='__main__':
     r = DlpReader('../data/20170725_1_G.3dlp')
@@ -0,0 +1,143 @@
+import logging
+logger = logging.getLogger('global')
+
+_COMPRESSOR_CLASSES = {'none': None, 'zlib': 'vtkZLibDataCompressor', 'lz4': 'vtkLZ4DataCompressor',
+                       'lzma': 'vtkLZMADataCompressor'}
+
+
+class Encoding(object):
+    '''
+    How a writer stores its arrays in the VTK XML file.
+    The defaults are those of vtkXMLWriter: appended, base64 encoded, zlib compressed.
+    For large clouds appended raw data with lz4 or no compression is usually much faster to write,
+    at the cost of a larger file that can't be inspected in a text editor.
+        VtuWriter('cell', points, values, encoding=Encoding(raw=True, compressor='lz4'))
+    '''
+    DATA_MODES = ('appended', 'binary', 'ascii')
+    COMPRESSORS = ('none', 'zlib', 'lz4', 'lzma')
+
+    def __init__(self, data_mode='appended', raw=False, compressor='zlib', level=None,
+                 block_size=None):
+        '''
+        :param data_mode: 'appended' (all arrays in one section at the end),
+            'binary' (base64 inline in each array) or 'ascii'
+        :param raw: If true, appended data is written as raw bytes instead of base64.
+            Only used in appended mode.
+        :param compressor: 'none', 'zlib', 'lz4' or 'lzma', ignored in ascii mode
+        :param level: compression level 1 (fast) - 9 (small), None keeps the compressor default
+        :param block_size: bytes per compressed block, a multiple of 8.
+            None keeps the default (32768).
+        '''
+        if data_mode not in self.DATA_MODES:
+            raise ValueError('Data mode should be one of {}, not {}'.format(self.DATA_MODES,
+                                                                             data_mode))
+        if compressor not in self.COMPRESSORS:
+            raise ValueError('Compressor should be one of {}, not {}'.format(self.COMPRESSORS,
+                                                                              compressor))
+        if level is not None and not 1 <= level <= 9:
+            raise ValueError('Compression level should be in 1-9, not {}'.format(level))
+        if block_size is not None and (block_size < 8 or block_size % 8):
+            raise ValueError('Block size should be a positive multiple of 8, not {}'.format(
+                block_size))
+        self.data_mode = data_mode
+        self.raw = raw
+        self.compressor = compressor
+        self.level = level
+        self.block_size = block_size
+
+    def configure(self, writer):
+        '''
+        Apply the settings to a vtkXMLWriter
+        '''
+        {'appended': writer.SetDataModeToAppended,
+         'binary': writer.SetDataModeToBinary,
+         'ascii': writer.SetDataModeToAscii}[self.data_mode]()
+        writer.SetEncodeAppendedData(not self.raw)
+        current = writer.GetCompressor()
+        # Replacing the default zlib compressor resets its level, which changes the output
+        if _COMPRESSOR_CLASSES[self.compressor] != (current.GetClassName() if current else None):
+            {'none': writer.SetCompressorTypeToNone,
+             'zlib': writer.SetCompressorTypeToZLib,
+             'lz4': writer.SetCompressorTypeToLZ4,
+             'lzma': writer.SetCompressorTypeToLZMA}[self.compressor]()
+        if self.level is not None:
+            writer.SetCompressionLevel(self.level)
+        if self.block_size is not None:
+            writer.SetBlockSize(self.block_size)
+
+    def __repr__(self):
+        return ('Encoding(data_mode={!r}, raw={!r}, compressor={!r}, level={!r}, '
+                'block_size={!r})').format(self.data_mode, self.raw, self.compressor, self.level,
+                                           self.block_size)
+
+
+def default_settings():
+    '''
+    :return: the encodings compared by benchmark_encodings when none are given
+    '''
+    return [Encoding(),
+            Encoding(raw=True, compressor='none'),
+            Encoding(raw=True, compressor='lz4'),
+            Encoding(raw=True, compressor='zlib', level=1),
+            Encoding(raw=True, compressor='zlib'),
+            Encoding(raw=True, compressor='lzma', level=1),
+            Encoding(data_mode='binary')]
+
+
+class HDFEncoding(object):
+    '''
+    How the hdf backend stores arrays in a VTKHDF file.
+    Arrays are chunked along the rows, so readers can load any range without reading the whole file.
+        VtuWriter('cell', points, values, backend='hdf',
+                  encoding=HDFEncoding(compression='gzip', level=1))
+    Only gzip is offered as compression, other HDF5 filters are not available in VTK's HDF5.
+    '''
+    COMPRESSORS = (None, 'gzip')
+
+    def __init__(self, compression=None, level=None, chunk_rows=1 << 16, shuffle=False):
+        '''
+        :param compression: None or 'gzip'
+        :param level: gzip level 0-9, None keeps the default (4)
+        :param chunk_rows: Number of rows per HDF5 chunk
+        :param shuffle: If true, apply the byte shuffle filter before compression,
+            which helps on float data
+        '''
+        if compression not in self.COMPRESSORS:
+            raise ValueError('Compression should be one of {}, not {}'.format(self.COMPRESSORS,
+                                                                               compression))
+        if level is not None and (compression != 'gzip' or not 0 <= level <= 9):
+            raise ValueError('Level {} is only valid in 0-9 for gzip compression'.format(level))
+        if chunk_rows < 1:
+            raise ValueError('Chunk rows should be >= 1, not {}'.format(chunk_rows))
+        self.compression = compression
+        self.level = level
+        self.chunk_rows = chunk_rows
+        self.shuffle = shuffle
+
+    def dataset_options(self, shape):
+        '''
+        :return: keyword arguments of h5py create_dataset for an array of this shape
+        '''
+        if shape[0] == 0:
+            return {}
+        options = {'chunks': (min(shape[0], self.chunk_rows),) + tuple(shape[1:])}
+        if self.compression is not None:
+            options['compression'] = self.compression
+            if self.level is not None:
+                options['compression_opts'] = self.level
+            options['shuffle'] = self.shuffle
+        return options
+
+    def __repr__(self):
+        return ('HDFEncoding(compression={!r}, level={!r}, chunk_rows={!r}, '
+                'shuffle={!r})').format(self.compression, self.level, self.chunk_rows, self.shuffle)
+
+
+def default_hdf_settings():
+    '''
+    :return: the encodings compared by benchmark_encodings for the hdf backend,
+        when none are given
+    '''
+    return [HDFEncoding(),
+            HDFEncoding(compression='gzip', level=1),
+            HDFEncoding(compression='gzip', shuffle=True)]
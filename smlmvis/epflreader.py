@@ -1,55 +1,25 @@
 import numpy as np
 import logging
+from smlmvis.csvreader import CSVReader
 logger = logging.getLogger('global')
-import pandas as pd
 
 
+class EPFLReader(CSVReader):
+    _column_dtypes = {'frame': np.uint32, 'Ground-truth': np.int32}
+    _frame_column = 'frame'
+    _coordinates = ['xnano', 'ynano', 'znano']
+    _columns = ['frame', 'Ground-truth', 'intensity ']
 
-
-class EPFLReader(object):
-    def __init__(self, filename):
+    def __init__(self, filename, lazy=False, cache=None, compact=False, columns=None, engine='c'):
         '''
         Parse EPFL Challenge dataset
         :param filename: Path to file
+        :param lazy: If true, defer decoding until points or values are used
+        :param cache: True or a DecodeCache to reuse decoded arrays across sessions
+        :param compact: If true, store frame and ground truth as integers and the rest as float32
+        :param columns: Value columns to load, defaults to ['frame', 'Ground-truth', 'intensity ']
+        :param engine: pandas CSV parser, 'c' or 'pyarrow'
         '''
-        self._filename = filename
-        self._values = None
-        self._points = None
         logger.debug("Starting decode for {}".format(filename))
-        self._read_ascii()
+        super().__init__(filename, lazy, cache, compact, columns, engine)
         logger.debug("Complete")
-
-
-    def _read_ascii(self):
-        data = pd.read_csv(self._filename)
-        pts = data[['xnano', 'ynano', 'znano']]
-        assert(pts.shape[1] == 3)
-        vls = data[['frame', 'Ground-truth', 'intensity ']]
-        self._points=pts.values.copy()
-        self._values=vls.values.copy()
-        self._columns = ['frame', 'Ground-truth', 'intensity ']
-
-
-    @property
-    def points(self):
-        return self._points
-
-    @property
-    def values(self):
-        return self._values
-
-    @property
-    def value_names(self):
-        return self._columns
-
-    def points_generator(self):
-        cnt = 0
-        l = len(self.points)
-        while cnt < l:
-            yield self._points[cnt]
-
-    def values_generator(self):
-        cnt = 0
-        l = len(self.values)
-        while cnt < l:
-            yield self._values[cnt]
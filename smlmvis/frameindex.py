@@ -0,0 +1,96 @@
+import os
+import json
+import numpy as np
+import logging
+logger = logging.getLogger('global')
+
+
+class FrameIndex(object):
+    '''
+    Sorted frame numbers of a dataset,
+    so the rows of a frame range are found with two binary searches.
+    For data that is not sorted on frame a stable sorting permutation is kept as well.
+    '''
+    def __init__(self, frames, order=None):
+        '''
+        :param frames: frame number of each row, sorted
+        :param order: permutation that sorts the rows on frame, None if they already are
+        '''
+        self._frames = frames
+        self._order = order
+
+    @classmethod
+    def build(cls, column):
+        '''
+        :param column: frame number of each row
+        '''
+        column = np.ascontiguousarray(column)
+        if np.all(column[1:] >= column[:-1]):
+            return cls(column)
+        order = np.argsort(column, kind='stable')
+        return cls(column[order], order)
+
+    @property
+    def sorted(self):
+        '''
+        True if the rows are in frame order, then rows() returns slices
+        '''
+        return self._order is None
+
+    @property
+    def first(self):
+        return self._frames[0]
+
+    @property
+    def last(self):
+        return self._frames[-1]
+
+    def rows(self, start, stop):
+        '''
+        :return: the rows with start <= frame < stop, as a slice if the data is sorted,
+            else an index array in frame order
+        '''
+        lo, hi = np.searchsorted(self._frames, [start, stop], side='left')
+        if self._order is None:
+            return slice(int(lo), int(hi))
+        return self._order[lo:hi]
+
+    def counts(self, start, stop):
+        '''
+        :return: number of rows with start <= frame < stop
+        '''
+        lo, hi = np.searchsorted(self._frames, [start, stop], side='left')
+        return int(hi - lo)
+
+    def save(self, filename, key=''):
+        '''
+        :param key: string identifying the data the index belongs to, checked by load
+        '''
+        order = np.empty(0, dtype=np.intp) if self._order is None else self._order
+        with open(filename, 'wb') as f:
+            np.savez(f, frames=self._frames, order=order, key=np.array(key))
+
+    @classmethod
+    def load(cls, filename, key=''):
+        '''
+        :return: the saved index, None if there is none or it was saved for other data (key differs)
+        '''
+        if not os.path.isfile(filename):
+            return None
+        try:
+            with np.load(filename) as data:
+                if str(data['key']) != key:
+                    return None
+                order = data['order']
+                return cls(data['frames'], order if len(order) else None)
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning('Ignoring unreadable frame index {} : {}'.format(filename, e))
+            return None
+
+
+def index_key(filename, params):
+    '''
+    :return: string identifying the version of filename and the reader parameters
+    '''
+    st = os.stat(filename)
+    return json.dumps([st.st_size, st.st_mtime_ns, params], sort_keys=True)
@@ -1,6 +1,12 @@
+import io
+import os
 import numpy as np
-import struct
+import pandas as pd
 import logging
+from concurrent.futures import ThreadPoolExecutor
+from smlmvis.basereader import BaseReader
+from smlmvis.parallel import read_parallel
+from smlmvis.query import Query
 logger = logging.getLogger('global')
 
 
@@ -12,11 +18,197 @@ def bytelength(name):
     d = {'I':4, 'f': 4}
     return d[name]
 
+
+def type_to_dtype(name):
+    d = {'I': '<u4', 'f': '<f4'}
+    return d[name]
+
 def desctotypes(filename):
     with open(filename, 'r') as f:
         return [(word[:word.index('(')].strip(), type_to_unpack(word[word.index('(')+1:word.index(')')])) for word in f.readline().split(',')]
 
 
+def desctodtype(encoding):
+    '''
+    :param encoding: list of (column name, unpack character) as returned by desctotypes
+    :return: numpy structured dtype describing one record (localization) of a GSD binary file
+    '''
+    return np.dtype([(name, type_to_dtype(t)) for name, t in encoding])
+
+
+def decode_gsd_records(data, dtype):
+    '''
+    Decode a GSD binary buffer in a single pass.
+    :param data: bytes like object with the content of the binary file
+    :param dtype: structured dtype as returned by desctodtype
+    :return: structured array (read only view on data) with one record per localization.
+        A truncated trailing record is dropped instead of failing the whole decode.
+    '''
+    linecount, trailing = divmod(len(data), dtype.itemsize)
+    if trailing:
+        logger.warning('Ignoring {} trailing bytes, last record is truncated or corrupt'.format(
+            trailing))
+    return np.frombuffer(data, dtype=dtype, count=linecount)
+
+
+def split_gsd_records(records):
+    '''
+    Split decoded GSD records in the (points, values) layout used by GSDReader
+    :param records: structured array of N records as returned by decode_gsd_records
+    :return: points N x 3 (x,y,z),
+        values N x 6 (stack_id, frame_id, eventid, pcount, sigma_x, sigma_y), both float64
+    '''
+    names = records.dtype.names
+    pointnames = names[3:6]
+    valuenames = names[0:3] + names[6:]
+    points = np.empty((len(records), len(pointnames)))
+    values = np.empty((len(records), len(valuenames)))
+    for i, name in enumerate(pointnames):
+        points[:, i] = records[name]
+    for i, name in enumerate(valuenames):
+        values[:, i] = records[name]
+    return points, values
+
+
+def split_gsd_columns(decoded):
+    '''
+    Split the 9 columns of a decoded GSD ASCII file in the (points, values) layout used by GSDReader
+    :param decoded: N x 9 float64 array
+    :return: points N x 3, values N x 6
+    '''
+    assert(decoded.shape[1] == 9)
+    values = np.empty((decoded.shape[0], decoded.shape[1] - 3))
+    points = decoded[:, 3:6]
+    values[:, 0:3] = decoded[:, 0:3]
+    values[:, 3:] = decoded[:, 6:]
+    return points, values
+
+
+def _ascii_blocks(filename, start, blocksize):
+    '''
+    Cut a text file in byte ranges of about blocksize, ending on a line boundary.
+    Only the line at each cut is read, the blocks are parsed by the workers.
+    :return: list of (offset, length)
+    '''
+    size = os.path.getsize(filename)
+    bounds = [start]
+    with open(filename, 'rb') as f:
+        for offset in range(start + blocksize, size, blocksize):
+            if offset <= bounds[-1]:
+                # The previous cut moved past this one, on a line longer than blocksize
+                continue
+            f.seek(offset - 1)
+            f.readline()
+            bounds.append(f.tell())
+    bounds.append(size)
+    return [(a, b - a) for a, b in zip(bounds[:-1], bounds[1:]) if b > a]
+
+
+def _count_ascii_lines(filename, offset, length, readsize=1 << 20):
+    '''
+    :return: number of lines in the byte range, blank and comment lines included
+    '''
+    lines, last = 0, b'\n'
+    with open(filename, 'rb') as f:
+        f.seek(offset)
+        while length > 0:
+            data = f.read(min(readsize, length))
+            if not data:
+                break
+            lines += data.count(b'\n')
+            last = data[-1:]
+            length -= len(data)
+    # A last line without a newline
+    return lines + (0 if last == b'\n' else 1)
+
+
+def _parse_ascii_block(filename, offset, length, points, values, row):
+    '''
+    Parse the lines in the byte range into points and values, from row on.
+    :return: number of rows written, less than the lines in the range if some are blank or comments
+    '''
+    with open(filename, 'rb') as f:
+        f.seek(offset)
+        data = f.read(length)
+    try:
+        decoded = pd.read_csv(io.BytesIO(data), header=None, comment='#', dtype=np.float64,
+                              engine='c').to_numpy()
+    except pd.errors.EmptyDataError:
+        return 0
+    if decoded.shape[1] != 9:
+        raise ValueError('Expected 9 columns, got {}'.format(decoded.shape[1]))
+    n = decoded.shape[0]
+    points[row:row + n] = decoded[:, 3:6]
+    values[row:row + n, 0:3] = decoded[:, 0:3]
+    values[row:row + n, 3:] = decoded[:, 6:]
+    return n
+
+
+def read_gsd_ascii(filename, blocksize=1 << 24, max_workers=None):
+    '''
+    Parse a GSD ASCII file with the pandas C parser,
+    in blocks of blocksize bytes parsed by a thread pool.
+    The workers first count the lines of their block, then decode it straight into its slice of
+    the preallocated points and values arrays.
+    :param filename: Path to file, the first line is a header if it starts with #
+    :param blocksize: Approximate number of bytes parsed per task
+    :param max_workers: Number of threads, defaults to the number of cores
+    :return: points N x 3, values N x 6 (stack_id, frame_id, eventid, pcount, sigma_x, sigma_y),
+        both float64
+    '''
+    with open(filename, 'rb') as f:
+        header = f.readline()
+    start = len(header) if header.startswith(b'#') else 0
+    blocks = _ascii_blocks(filename, start, blocksize)
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        lines = list(pool.map(lambda block: _count_ascii_lines(filename, *block), blocks))
+        rows = np.concatenate(([0], np.cumsum(lines, dtype=np.int64)))
+        points = np.empty((rows[-1], 3))
+        values = np.empty((rows[-1], 6))
+        futures = [pool.submit(_parse_ascii_block, filename, offset, length, points, values, row)
+                   for (offset, length), row in zip(blocks, rows)]
+        parsed = [future.result() for future in futures]
+    if parsed != lines:
+        # Blank or commented lines, drop the unused rows at the end of those blocks
+        keep = np.zeros(rows[-1], dtype=bool)
+        for row, n in zip(rows, parsed):
+            keep[row:row + n] = True
+        points, values = points[keep], values[keep]
+    return points, values
+
+
+def map_gsd_records(filename, dtype):
+    '''
+    Memory map a GSD binary file without reading it.
+    :param filename: Path to the binary file
+    :param dtype: structured dtype as returned by desctodtype
+    :return: read only np.memmap of records, None if the file holds no complete record
+    '''
+    linecount, trailing = divmod(os.path.getsize(filename), dtype.itemsize)
+    if trailing:
+        logger.warning('Ignoring {} trailing bytes, last record is truncated or corrupt'.format(
+            trailing))
+    if linecount == 0:
+        return None
+    return np.memmap(filename, dtype=dtype, mode='r', shape=(linecount,))
+
+
+def records_view(records, names):
+    '''
+    Zero copy N x len(names) view on records, if the named fields are adjacent and of the same type.
+    :param records: structured array (or memmap) of records
+    :param names: field names, in order
+    :return: strided view, or None if the fields can't be viewed as a 2D array
+    '''
+    fields = [records.dtype.fields[name] for name in names]
+    ftype = fields[0][0]
+    for i, (t, offset) in enumerate(fields):
+        if t != ftype or offset != fields[0][1] + i * ftype.itemsize:
+            return None
+    return np.ndarray((len(records), len(names)), dtype=ftype, buffer=records, offset=fields[0][1],
+                      strides=(records.dtype.itemsize, ftype.itemsize))
+
+
 def mask_z(points, values, threshold):
     '''
     :param points: np array 3xN
@@ -63,7 +255,7 @@ def filter_z_plane(points, values, z, Z):
     :return: A filtered copy of points, values
     '''
     assert(points.shape[1] == 3)
-    logger.info('Min {} Max {}'.format(z, Zb))
+    logger.info('Min {} Max {}'.format(z, Z))
     m = (points[:,2] > z) & (points[:,2] <= Z)
     return points[m].copy(), values[m].copy()
 
@@ -121,55 +313,174 @@ def loadcell(n, tree):
             bin_filename = files(tree, n, di, ab)
             r = GSDReader(bin_filename)
             raw_points, raw_values = r.points, r.values
-            fpoints, fvalues = mask_z(raw_points, raw_values, 1e30)
+            fpoints, fvalues, _ = mask_z(raw_points, raw_values, 1e30)
             (x,y,z), (stack_id, frame_id, eventid, pcount, sigma_x, sigma_y) = split_gsd_data(fpoints, fvalues)
             data[di][ab]=(x,y,z), (stack_id, frame_id, eventid, pcount, sigma_x, sigma_y)
     return data
 
 
+def loadcell_parallel(n, tree, max_workers=None):
+    '''
+    Parallel version of loadcell, all files of the cell are decoded concurrently in a process pool.
+    :param n: String integer cell number
+    :param tree:  Nested dict of cell number, dilution, antibody , filename
+    :param max_workers: Number of processes, defaults to the number of cores
+    :return: dict of data[dilution][antiobody] = (x,y,z),
+             (stack_id, frame_id, eventid, pcount, sigma_x, sigma_y)
+    '''
+    return loadexperiment_parallel(tree, [n], max_workers)[n]
+
+
+def loadexperiment_parallel(tree, cells=None, max_workers=None):
+    '''
+    Load all cells of an experiment, with all files decoded concurrently in one process pool.
+    :param tree:  Nested dict of cell number, dilution, antibody , filename
+    :param cells: Cell numbers to load, defaults to all keys of tree
+    :param max_workers: Number of processes, defaults to the number of cores
+    :return: dict of data[cell] = loadcell(cell, tree).
+        Files that can't be decoded are logged and left out.
+    '''
+    cells = list(tree.keys()) if cells is None else cells
+    data = {}
+    jobs = []
+    for n in cells:
+        data[n] = {}
+        for di in dilutions(tree, n):
+            data[n][di] = {}
+            for ab in antibodies(tree, n, di):
+                jobs.append((n, di, ab, files(tree, n, di, ab)))
+    decoded = read_parallel([bin_filename for _, _, _, bin_filename in jobs], GSDReader,
+                            max_workers)
+    for (n, di, ab, bin_filename), (raw_points, raw_values) in zip(jobs, decoded):
+        if raw_points is None:
+            logger.error('Skipping {} of cell {}, {}, {}: it could not be decoded'.format(
+                bin_filename, n, di, ab))
+            continue
+        fpoints, fvalues, _ = mask_z(raw_points, raw_values, 1e30)
+        data[n][di][ab] = split_gsd_data(fpoints, fvalues)
+    return data
+
+
 def loadcellfile(fname):
     r = GSDReader(fname)
     raw_points, raw_values = r.points, r.values
-    fpoints, fvalues = mask_z(raw_points, raw_values, 1e30)
+    fpoints, fvalues, _ = mask_z(raw_points, raw_values, 1e30)
     (x, y, z), (stack_id, frame_id, eventid, pcount, sigma_x, sigma_y) = split_gsd_data(fpoints, fvalues)
     return (x, y, z), (stack_id, frame_id, eventid, pcount, sigma_x, sigma_y)
 
 
-class GSDReader(object):
+class GSDReader(BaseReader):
     '''
         Read a GSD file into memory
         Filename is the name of the binary data file, with a corresponding filename.desc file in the same location.
         This header file is parsed to get the alignment (int, float, etc).
+        With mmap=True the binary file is memory mapped instead,
+        and columns are only read from disk when used.
     '''
-    def __init__(self, filename, preprocess=True, binary=True):
+    def __init__(self, filename, preprocess=True, binary=True, mmap=False, lazy=False, cache=None,
+                 compact=False):
         '''
         Parse GSD files.
         :param filename: Path to file (if binary, expects filename.desc with headers for encoding
         :param preprocess: If true, remove invalid values
         :param binary: If true, reads binary files. If False, ascii.
+        :param mmap: If true (binary only), back the data with a read only memory map of the file.
+            points is then a float32 view on the file (a copy of the valid rows if preprocess
+            removes any), values is assembled on first access, and column(name) gives single
+            columns without loading the rest.
+        :param lazy: If true, defer decoding until points or values are used
+        :param cache: True or a DecodeCache to reuse decoded arrays across sessions
+            (ignored with mmap)
+        :param compact: If true, keep each value column in the type of the file (uint32 or float32)
+            and points as float32, instead of float64 arrays.
+            mmap mode already provides typed columns through column().
         '''
-        self._filename = filename
-        self._values = None
-        self._points = None
+        self._records = None
+        self._rows = None
         self._preprocess = preprocess
         logger.debug("Starting decode for {}".format(filename))
         self._binary = binary
+        self._mmap = mmap and binary
+        if mmap and not binary:
+            logger.warning('Memory mapping is only supported for binary files, '
+                           'reading {} into memory'.format(filename))
         if self._binary:
             self._GSD_Encoding=desctotypes(filename+'.desc')
             logger.debug('Decoded types: {}'.format(self._GSD_Encoding))
             self._unpack_string = ''.join(t for _,t in self._GSD_Encoding)
             # logger.info('Unpack String: {}'.format(self._unpack_string))
             self._columns = [n for n, _ in self._GSD_Encoding]
-            self._read_binary()
+        else:
+            self._read_ascii_header(filename)
+        self._column_dtypes = {name: type_to_dtype(t) for name, t in self._GSD_Encoding}
+        self._frame_column = self._columns[1]
+        super().__init__(filename, lazy, None if self._mmap else cache, compact)
+
+    def _value_names(self):
+        # value_names also lists x, y, z
+        return self._columns[0:3] + self._columns[6:]
+
+    def _cache_params(self):
+        params = super()._cache_params()
+        params.update({'preprocess': self._preprocess, 'binary': self._binary})
+        if self._binary:
+            # The layout comes from the .desc file, which can change without the binary file
+            params['encoding'] = self._GSD_Encoding
+        return params
+
+    def _get_state(self):
+        state = super()._get_state()
+        if state is not None and self._preprocess:
+            state['pct'] = np.array([self._pct])
+        return state
+
+    def _set_state(self, state):
+        super()._set_state(state)
+        if self._preprocess:
+            self._pct = float(state['pct'][0])
+
+    def _read(self):
+        if self._binary:
+            if self._mmap:
+                self._map_binary()
+            else:
+                self._read_binary()
         else:
             self._read_ascii()
         self._post_read()
 
+    def _read_chunks(self, chunk_size):
+        if self._binary:
+            dtype = desctodtype(self._GSD_Encoding)
+            with open(self._filename, 'rb') as f:
+                while True:
+                    data = f.read(chunk_size * dtype.itemsize)
+                    if not data:
+                        return
+                    records = decode_gsd_records(data, dtype)
+                    yield self._preprocess_chunk(*split_gsd_records(records))
+        else:
+            for data in pd.read_csv(self._filename, header=None, comment='#', dtype=np.float64,
+                                    chunksize=chunk_size):
+                yield self._preprocess_chunk(*split_gsd_columns(data.to_numpy()))
+
+    def _preprocess_chunk(self, points, values):
+        if self._preprocess and len(points):
+            points, values, _ = gsd_preprocess(points, values)
+        return points, values
+
     def _post_read(self):
+        if self._mmap:
+            self._post_map()
+            return
         if self._points is None:
             logger.error("Decoding failed, can't preprocess")
             return
         N = self._points.shape[0]
+        if N == 0:
+            logger.error('No localizations in {}'.format(self._filename))
+            self._points, self._values = None, None
+            return
         if self._preprocess:
             # logger.debug("Pre Processing data for invalid Z coordinates")
             fp, fv, pct = gsd_preprocess(self._points, self._values)
@@ -182,22 +493,17 @@ class GSDReader(object):
             pass
         logger.debug('Mean X {} Mean Y {} Mean Z{}'.format(np.mean(self._points[:,0]), np.mean(self._points[:,1]), np.mean(self._points[:,2])))
 
-
-    def _read_ascii(self):
-        data = None
-        with open(self._filename) as f:
+    def _read_ascii_header(self, filename):
+        with open(filename) as f:
             line = f.readline()
             if '#' in line:
                 line = line[1:]
             self._GSD_Encoding = [(word[:word.index('(')].strip(), type_to_unpack(word[word.index('(')+1:word.index(')')])) for word in line.split(',')]
             self._columns = [n for n, _ in self._GSD_Encoding]
+
+    def _read_ascii(self):
         try:
-            decoded = np.loadtxt(self._filename, delimiter=',', dtype='float64')
-            assert(decoded.shape[1] == 9)
-            self._values = np.empty((decoded.shape[0], decoded.shape[1]-3))
-            self._points = decoded[:,3:6]
-            self._values[:,0:3] = decoded[:,0:3]
-            self._values[:,3:] = decoded[:,6:]
+            self._points, self._values = read_gsd_ascii(self._filename)
 
         except Exception as e:
             logger.error('Failed parsing file with exception {}'.format(e))
@@ -205,62 +511,103 @@ class GSDReader(object):
 
     def _read_binary(self):
         data = None
-        linelength = sum(bytelength(t) for t in self._unpack_string)
-
         with open(self._filename, "rb") as f:
             data = f.read()
 
-        bytecount = len(data)
-        assert(bytecount % linelength == 0)
-        linecount = int(bytecount / linelength)
-        # logger.debug('Have {} bytes, {} bytes per line, {} lines.'.format(bytecount, linelength, linecount))
-
-        points = np.empty((linecount, 3))
-        values = np.empty((linecount, 6))
         if data:
-            for linenumber in range(linecount):
-                line = data[ linenumber * linelength : (linenumber+1)*linelength]
-                assert(len(line)== linelength)
-                decoded = struct.unpack(self._unpack_string, line)
-                x, y, z = decoded[3:6]
-                points[linenumber] = x, y, z
-                values[linenumber] = decoded[0:3] + decoded[6:]
+            records = decode_gsd_records(data, desctodtype(self._GSD_Encoding))
+            # logger.debug('Have {} bytes, {} bytes per line, {} lines.'.format(
+            #     len(data), records.dtype.itemsize, len(records)))
+            self._points, self._values = split_gsd_records(records)
             logger.info('Decoding complete of file {}'.format(self._filename))
-            self._points = points
-            self._values = values
         else:
             logger.error('Failed reading data.')
         # logger.debug('Mean X {} Mean Y {} Mean Z{}'.format(np.mean(self._points[:,0]), np.mean(self._points[:,1]), np.mean(self._points[:,2])))
 
+    def _map_binary(self):
+        self._records = map_gsd_records(self._filename, desctodtype(self._GSD_Encoding))
+        if self._records is None:
+            logger.error('Failed reading data.')
+        else:
+            logger.info('Mapped {} records of file {}'.format(len(self._records), self._filename))
 
+    def _post_map(self):
+        if self._records is None:
+            logger.error("Decoding failed, can't preprocess")
+            return
+        if self._preprocess:
+            # Same criterion as gsd_preprocess, only the Z column is read
+            N = len(self._records)
+            mask = abs(self._records[self._columns[5]]) < 1e15
+            n = np.count_nonzero(mask)
+            self._pct = ((N - n) / N) * 100
+            if n < N:
+                self._rows = np.flatnonzero(mask)
+            logger.debug("Retained {} out {} points".format(n, N))
+
+    def column(self, name):
+        '''
+        :param name: Name of a column in value_names
+        :return: 1D array of that column.
+            In mmap mode this is a view on the file if no rows were removed.
+        '''
+        self._load()
+        if self._records is not None:
+            col = self._records[name]
+            return col if self._rows is None else col[self._rows]
+        if self._store is not None and name in self._store.names:
+            return self._store[name]
+        index = self._columns.index(name)
+        if 3 <= index < 6:
+            return self.points[:, index - 3]
+        return self.values[:, index if index < 3 else index - 3]
+
+    def _assemble(self, names, dtype=None):
+        if self._rows is None and dtype is None:
+            view = records_view(self._records, names)
+            if view is not None:
+                return view
+        if dtype is None:
+            dtype = np.result_type(*[self._records.dtype.fields[name][0] for name in names])
+        n = len(self._records) if self._rows is None else len(self._rows)
+        result = np.empty((n, len(names)), dtype=dtype)
+        for i, name in enumerate(names):
+            result[:, i] = self.column(name)
+        return result
 
     @property
     def points(self):
+        self._load()
+        if self._points is None and self._records is not None:
+            self._points = self._assemble(self._columns[3:6])
         return self._points
 
+    def _select(self, rows):
+        if self._records is None:
+            return super()._select(rows)
+        # Only decode the selected records
+        records = self._records[rows if self._rows is None else self._rows[rows]]
+        return self.points[rows], split_gsd_records(records)[1]
+
+    def query(self):
+        points = self.points
+        return Query(points, self.values if self._store is None else self._store,
+                     self._value_names())
+
     @property
     def invalid_data_pct(self):
+        self._load()
         return self._pct
 
     @property
     def values(self):
+        self._load()
+        if self._values is None and self._store is not None:
+            self._values = self._store.values()
+        if self._values is None and self._records is not None:
+            self._values = self._assemble(self._value_names(), np.float64)
         return self._values
 
-    @property
-    def value_names(self):
-        return self._columns
-
-    def points_generator(self):
-        cnt = 0
-        l = len(self.points)
-        while cnt < l:
-            yield self._points[cnt]
-
-    def values_generator(self):
-        cnt = 0
-        l = len(self.values)
-        while cnt < l:
-            yield self._values[cnt]
 #
 # if __name__=='__main__':
 #     # r = DlpReader('../data/20170725_1_G.3dlp')
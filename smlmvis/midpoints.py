@@ -0,0 +1,73 @@
+import numpy as np
+import logging
+from scipy.spatial import cKDTree
+from smlmvis.vtuwriter import channel_offsets
+logger = logging.getLogger('global')
+
+
+def _query(tree, source, max_distance, workers):
+    distances, indices = tree.query(source, k=1, distance_upper_bound=max_distance, workers=workers)
+    found = np.flatnonzero(indices < tree.n)
+    pairs = np.empty((len(found), 2), dtype=np.int64)
+    pairs[:, 0] = found
+    pairs[:, 1] = indices[found]
+    return pairs, distances[found]
+
+
+def nearest_neighbours(source, target, max_distance=np.inf, workers=-1):
+    '''
+    The nearest target point of each source point, queried in parallel.
+    :param source: N x 3 array
+    :param target: M x 3 array
+    :param max_distance: source points without a target within this distance are left out
+    :param workers: Number of threads of cKDTree.query, -1 for all cores
+    :return: (E x 2 int64 array of (source index, target index), E distances)
+    '''
+    if len(source) == 0 or len(target) == 0:
+        return np.empty((0, 2), dtype=np.int64), np.empty(0)
+    return _query(cKDTree(target), source, max_distance, workers)
+
+
+def _channel_pairs(pointset, max_distance, workers):
+    '''
+    :return: generator of (i, j, pairs, distances)
+        for all ordered pairs of non empty point sets i != j
+    '''
+    trees = [cKDTree(points) if len(points) else None for points in pointset]
+    for i, source in enumerate(pointset):
+        for j, tree in enumerate(trees):
+            if i != j and tree is not None and len(source):
+                yield (i, j) + _query(tree, source, max_distance, workers)
+
+
+def channel_neighbours(pointset, max_distance=np.inf, workers=-1):
+    '''
+    Nearest neighbours from each point set to each other point set, see nearest_neighbours.
+    :param pointset: list of k n_i x 3 arrays
+    :return: dict of (source offset, target offset) -> (E x 2 pairs, E distances) for all ordered
+        pairs of non empty sets, offsets as in channel_offsets.
+        {key: pairs} are the edges of NNWriter.
+    '''
+    offsets = channel_offsets(pointset)
+    return {(offsets[i], offsets[j]): (pairs, distances)
+            for i, j, pairs, distances in _channel_pairs(pointset, max_distance, workers)}
+
+
+def channel_midpoints(pointset, max_distance=np.inf, workers=-1):
+    '''
+    Midpoints between each point and its nearest neighbour in each other point set,
+    as arrays MidPointWriter takes:
+        MidPointWriter('midpoints', channel_midpoints([red, green]))
+    :param pointset: list of k n_i x 3 arrays
+    :return: dict of (source offset, target offset) -> (E x 3 midpoints, E x 3 values),
+        the values of a midpoint are (source index, target index, distance)
+    '''
+    offsets = channel_offsets(pointset)
+    midpoints = {}
+    for i, j, pairs, distances in _channel_pairs(pointset, max_distance, workers):
+        values = np.empty((len(pairs), 3))
+        values[:, :2] = pairs
+        values[:, 2] = distances
+        centers = (pointset[i][pairs[:, 0]] + pointset[j][pairs[:, 1]]) / 2
+        midpoints[(offsets[i], offsets[j])] = centers, values
+    return midpoints
@@ -0,0 +1,113 @@
+import os
+import numpy as np
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+logger = logging.getLogger('global')
+
+# On Windows a shared memory block disappears with its last open handle,
+# so the creating process keeps it open.
+_keepalive = []
+
+
+def to_shared(array):
+    '''
+    Copy array into a new shared memory block.
+    :param array: numpy array
+    :return: (name, shape, dtype) handle for from_shared, which also releases the block
+    '''
+    array = np.ascontiguousarray(array)
+    shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)[...] = array
+    if os.name == 'nt':
+        _keepalive.append(shm)
+    else:
+        shm.close()
+    return shm.name, array.shape, array.dtype.str
+
+
+def from_shared(handle):
+    '''
+    Copy an array out of a shared memory block made by to_shared (in any process),
+    and release the block.
+    :param handle: (name, shape, dtype) as returned by to_shared
+    :return: numpy array
+    '''
+    name, shape, dtype = handle
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        array = np.ndarray(shape, dtype=dtype, buffer=shm.buf).copy()
+    finally:
+        shm.close()
+        shm.unlink()
+    return array
+
+
+def share(array):
+    '''
+    Copy array into a new shared memory block,
+    that stays available to any number of workers until released.
+    :return: (shm, handle), release with shm.close(); shm.unlink() once the workers are done
+    '''
+    array = np.ascontiguousarray(array)
+    shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)[...] = array
+    return shm, (shm.name, array.shape, array.dtype.str)
+
+
+def attach(handle):
+    '''
+    :param handle: handle returned by share
+    :return: (shm, array), array is a view on the block. Delete it before calling shm.close().
+    '''
+    name, shape, dtype = handle
+    shm = shared_memory.SharedMemory(name=name)
+    return shm, np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+
+
+def _read_shared(reader, filename, kwargs):
+    r = reader(filename, **kwargs)
+    points, values = r.points, r.values
+    if points is None:
+        return None
+    return to_shared(points), to_shared(values)
+
+
+def process_pool(max_workers=None):
+    '''
+    :param max_workers: Number of processes, defaults to the number of cores
+    :return: ProcessPoolExecutor that can exchange arrays with to_shared/from_shared
+    '''
+    if os.name == 'posix':
+        # Workers must report blocks to the tracker of this process,
+        # or their blocks are removed when they exit
+        from multiprocessing import resource_tracker
+        resource_tracker.ensure_running()
+    return ProcessPoolExecutor(max_workers=max_workers)
+
+
+def read_parallel(filenames, reader, max_workers=None, **kwargs):
+    '''
+    Decode files concurrently in a process pool.
+    Arrays are returned through shared memory instead of pickles.
+    :param filenames: List of paths
+    :param reader: Reader class (e.g. GSDReader),
+        constructed as reader(filename, **kwargs) in a worker
+    :param max_workers: Number of processes, defaults to the number of cores
+    :return: List of (points, values), in the order of filenames.
+        (None, None) for files that failed to decode.
+    '''
+    with process_pool(max_workers) as pool:
+        futures = [pool.submit(_read_shared, reader, filename, kwargs) for filename in filenames]
+        results = []
+        for filename, future in zip(filenames, futures):
+            try:
+                handles = future.result()
+            except Exception as e:
+                logger.error('Decoding failed for {} with exception {}'.format(filename, e))
+                handles = None
+            if handles is None:
+                results.append((None, None))
+            else:
+                results.append(tuple(from_shared(handle) for handle in handles))
+    return results
@@ -0,0 +1,165 @@
+import numpy as np
+import logging
+from smlmvis.columnstore import ColumnStore
+logger = logging.getLogger('global')
+try:
+    import numexpr
+except ImportError:
+    numexpr = None
+
+_OPS = {'<': np.less, '<=': np.less_equal, '>': np.greater, '>=': np.greater_equal}
+
+
+class Query(object):
+    '''
+    Lazy row selection on points, values.
+    Predicates are recorded and only evaluated when a result is asked for, as one combined boolean
+    mask (with numexpr if it is installed), so a chain of filters costs a single pass and a single
+    copy.
+        q = reader.query().z(-500, 500).roi((0, 0), (1e4, 1e4)).photons(k_sd=3)
+        points, values = q.collect()
+    Each predicate returns a new Query, so a partial chain can be reused.
+    '''
+    def __init__(self, points, values, value_names=None, terms=None):
+        '''
+        :param points: N x 3 np array
+        :param values: N x k np array, or the ColumnStore of a compact reader. Columns of a
+            ColumnStore are read one by one, only collect() assembles the selected rows.
+        :param value_names: names of the columns of values, to refer to columns by name
+        '''
+        self._points = points
+        self._values = values
+        self._store = isinstance(values, ColumnStore)
+        self._names = values.names if self._store and value_names is None else value_names
+        self._terms = terms or []
+
+    def _add(self, *terms):
+        return Query(self._points, self._values, self._names, self._terms + list(terms))
+
+    def _value_index(self, column):
+        if isinstance(column, str):
+            if self._names is None:
+                raise ValueError('No value names to look up column {}'.format(column))
+            return self._names.index(column)
+        return column
+
+    def valid_z(self, threshold=1e15):
+        '''
+        Keep rows where abs(z) < threshold, as mask_z
+        '''
+        return self._add((('p', 2), 'abs<', threshold))
+
+    def z(self, zmin, zmax):
+        '''
+        Keep rows where zmin < z <= zmax, as filter_z_plane
+        '''
+        return self._add((('p', 2), '>', zmin), (('p', 2), '<=', zmax))
+
+    def roi(self, roimin, roimax):
+        '''
+        Keep rows strictly inside the box roimin - roimax, as slice_roi.
+        The box can have fewer dimensions than the points.
+        '''
+        terms = []
+        for i, (m, M) in enumerate(zip(roimin, roimax)):
+            terms += [(('p', i), '>', m), (('p', i), '<', M)]
+        return self._add(*terms)
+
+    def value(self, column, vmin=None, vmax=None):
+        '''
+        Keep rows where vmin <= values[:, column] <= vmax, a bound of None is not checked.
+        :param column: index or name of the column
+        '''
+        index = self._value_index(column)
+        terms = []
+        if vmin is not None:
+            terms.append((('v', index), '>=', vmin))
+        if vmax is not None:
+            terms.append((('v', index), '<=', vmax))
+        return self._add(*terms)
+
+    def photons(self, k_sd=3, column=3):
+        '''
+        Keep rows where the photon count is <= mean + k_sd * sd, as filter_photoncount_outliers.
+        Mean and sd are computed on the rows selected by the predicates before this one.
+        :param column: index or name of the photon count column (3 for GSD)
+        '''
+        index = self._value_index(column)
+
+        def threshold(mask):
+            pc = self._column(('v', index))
+            if mask is not None:
+                pc = pc[mask]
+            t = np.mean(pc) + k_sd * np.std(pc)
+            logger.info('Treshold {}'.format(t))
+            return (('v', index), '<=', t)
+        return self._add(threshold)
+
+    def _column(self, key):
+        kind, index = key
+        if kind == 'p':
+            return self._points[:, index]
+        if self._store:
+            return self._values[self._values.names[index]]
+        return self._values[:, index]
+
+    def _evaluate(self, terms, mask):
+        if not terms:
+            return mask
+        if numexpr is not None:
+            variables, expressions = {}, []
+            for i, (key, op, constant) in enumerate(terms):
+                name = '{}{}'.format(*key)
+                variables[name] = self._column(key)
+                variables['c{}'.format(i)] = constant
+                if op == 'abs<':
+                    expressions.append('(abs({}) < c{})'.format(name, i))
+                else:
+                    expressions.append('({} {} c{})'.format(name, op, i))
+            if mask is not None:
+                variables['mask'] = mask
+                expressions.append('mask')
+            return numexpr.evaluate(' & '.join(expressions), local_dict=variables)
+        for key, op, constant in terms:
+            column = self._column(key)
+            if op == 'abs<':
+                term = np.abs(column) < constant
+            else:
+                term = _OPS[op](column, constant)
+            mask = term if mask is None else np.logical_and(mask, term, out=mask)
+        return mask
+
+    def mask(self):
+        '''
+        :return: boolean array of length N, True for selected rows
+        '''
+        mask, pending = None, []
+        for term in self._terms:
+            if callable(term):
+                mask = self._evaluate(pending, mask)
+                pending = []
+                term = term(mask)
+            pending.append(term)
+        mask = self._evaluate(pending, mask)
+        if mask is None:
+            mask = np.ones(len(self._points), dtype=bool)
+        return mask
+
+    def indices(self):
+        '''
+        :return: indices of the selected rows, without copying points or values
+        '''
+        return np.flatnonzero(self.mask())
+
+    def count(self):
+        return int(np.count_nonzero(self.mask()))
+
+    def collect(self):
+        '''
+        :return: copies of the selected points, values
+        '''
+        mask = self.mask()
+        logger.info('Selected {} out of {} points'.format(np.count_nonzero(mask), len(mask)))
+        if self._store:
+            return self._points[mask], self._values.values(mask)
+        return self._points[mask], self._values[mask]
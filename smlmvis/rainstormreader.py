@@ -1,47 +1,27 @@
 import numpy as np
-import pandas as pd
+from smlmvis.csvreader import CSVReader
 
-class RainStormReader(object):
-    def __init__(self, filename):
-        self._filename = filename
-        self._values = None
-        self._points = None
-        self._columns = ['idx', 'frame_idx', 'x_coord', 'y_coord', 'I', 'sig_x',
-       'sig_y', 'avg_brightness', 'res', 'res_Row', 'res_Col', 'roi_min',
-       'Sum_signal', 'Sum_signal_ph', 'x_std', 'y_std',
-       'ellip_xy']
-        self._read()
 
-    def _read(self):
-        data = pd.read_csv(self._filename)
-        pxtonm = max(data['x_nm']) / max(data['x_coord'])
-        self._points = data[['x_nm', 'y_nm', 'z_coord']].values.copy()
-        self._points[:,2] *= pxtonm
-        self._values = data[['idx', 'frame_idx', 'x_coord', 'y_coord', 'I', 'sig_x',
+class RainStormReader(CSVReader):
+    _column_dtypes = {'idx': np.uint32, 'frame_idx': np.uint32}
+    _frame_column = 'frame_idx'
+    _coordinates = ['x_nm', 'y_nm', 'z_coord']
+    _extra = ['x_nm', 'x_coord']  # pixel size
+    _columns = ['idx', 'frame_idx', 'x_coord', 'y_coord', 'I', 'sig_x',
        'sig_y', 'avg_brightness', 'res', 'res_Row', 'res_Col', 'roi_min',
        'Sum_signal', 'Sum_signal_ph', 'x_std', 'y_std',
-       'ellip_xy']].values.copy()
-
-    @property
-    def points(self):
-        return self._points
-
-    @property
-    def values(self):
-        return self._values
-
-    @property
-    def value_names(self):
-        return self._columns
+       'ellip_xy']
 
-    def points_generator(self):
-        cnt = 0
-        l = len(self.points)
-        while cnt < l:
-            yield self._points[cnt]
+    def _read_chunks(self, chunk_size):
+        pxtonm = None
+        for data in self._read_csv(chunksize=chunk_size):
+            # The pixel size is a constant ratio, the first block determines it for all others
+            pxtonm = pxtonm or data['x_nm'].max() / data['x_coord'].max()
+            yield self._split(data, pxtonm)
 
-    def values_generator(self):
-        cnt = 0
-        l = len(self.values)
-        while cnt < l:
-            yield self._values[cnt]
+    def _split(self, data, pxtonm=None):
+        if pxtonm is None:
+            pxtonm = data['x_nm'].max() / data['x_coord'].max()
+        points, values = super()._split(data)
+        points[:, 2] *= pxtonm
+        return points, values
@@ -0,0 +1,180 @@
+import numpy as np
+import logging
+from smlmvis.vtkxml import VTK_POLY_VERTEX, data_type
+from smlmvis.encoding import HDFEncoding
+logger = logging.getLogger('global')
+try:
+    import h5py
+except ImportError:
+    h5py = None
+
+
+def _require_h5py():
+    if h5py is None:
+        raise ImportError('VTKHDF output needs the h5py package')
+
+
+def _dataset(group, name, array, dtype, encoding):
+    '''
+    Create group/name from array, converted to dtype and written one HDF5 chunk of rows at a time
+    :param array: numpy array or IndexRange
+    '''
+    dataset = group.create_dataset(name, shape=array.shape, dtype=dtype,
+                                   **encoding.dataset_options(array.shape))
+    step = encoding.chunk_rows * 16
+    for start in range(0, array.shape[0], step):
+        dataset[start:start + step] = np.asarray(array[start:start + step], dtype=dtype)
+    return dataset
+
+
+def _root(f, kind):
+    root = f.create_group('VTKHDF')
+    root.attrs['Version'] = np.array([2, 2], dtype=np.int64)
+    root.attrs.create('Type', np.bytes_(kind))
+    return root
+
+
+def write_unstructured_grid(filename, points, point_data, cells, cell_data=(), encoding=None):
+    '''
+    Write a VTKHDF UnstructuredGrid, the arguments are those of vtkxml.write_unstructured_grid
+    :param encoding: HDFEncoding
+    '''
+    _require_h5py()
+    encoding = encoding or HDFEncoding()
+    types, offsets, connectivity = cells
+    with h5py.File(filename, 'w') as f:
+        root = _root(f, 'UnstructuredGrid')
+        root.create_dataset('NumberOfPoints', data=np.array([len(points)], dtype=np.int64))
+        root.create_dataset('NumberOfCells', data=np.array([len(types)], dtype=np.int64))
+        root.create_dataset('NumberOfConnectivityIds',
+                            data=np.array([len(connectivity)], dtype=np.int64))
+        _dataset(root, 'Points', points, np.float32, encoding)
+        _dataset(root, 'Connectivity', connectivity, np.int64, encoding)
+        _dataset(root, 'Offsets', np.asarray(offsets), np.int64, encoding)
+        _dataset(root, 'Types', np.asarray(types), np.uint8, encoding)
+        for group, data in ((root.create_group('PointData'), point_data),
+                            (root.create_group('CellData'), cell_data)):
+            for name, array in data:
+                _dataset(group, name, array, data_type(array), encoding)
+        root.create_group('FieldData')
+
+
+def write_polydata(filename, points, point_data, verts, lines, encoding=None):
+    '''
+    Write a VTKHDF PolyData, the arguments are those of vtkxml.write_polydata
+    :param encoding: HDFEncoding
+    '''
+    _require_h5py()
+    encoding = encoding or HDFEncoding()
+    empty = (np.zeros(1, dtype=np.int64), np.empty(0, dtype=np.int64))
+    with h5py.File(filename, 'w') as f:
+        root = _root(f, 'PolyData')
+        root.create_dataset('NumberOfPoints', data=np.array([len(points)], dtype=np.int64))
+        _dataset(root, 'Points', points, np.float32, encoding)
+        cells = (('Vertices', verts), ('Lines', lines), ('Polygons', empty), ('Strips', empty))
+        for tag, (offsets, connectivity) in cells:
+            group = root.create_group(tag)
+            group.create_dataset('NumberOfCells', data=np.array([len(offsets) - 1], dtype=np.int64))
+            group.create_dataset('NumberOfConnectivityIds',
+                                 data=np.array([len(connectivity)], dtype=np.int64))
+            _dataset(group, 'Connectivity', connectivity, np.int64, encoding)
+            _dataset(group, 'Offsets', offsets, np.int64, encoding)
+        group = root.create_group('PointData')
+        for name, array in point_data:
+            _dataset(group, name, array, data_type(array), encoding)
+        root.create_group('CellData')
+        root.create_group('FieldData')
+
+
+def write_image_data(filename, shape, origin, direction, point_data, encoding=None):
+    '''
+    Write a VTKHDF ImageData, the arguments are those of vtkxml.write_image_data
+    :param encoding: HDFEncoding, a chunk holds about chunk_rows values
+    '''
+    _require_h5py()
+    encoding = encoding or HDFEncoding()
+    nx, ny, nz = shape
+    with h5py.File(filename, 'w') as f:
+        root = _root(f, 'ImageData')
+        extent = np.array([(0, n - 1) for n in shape], dtype=np.int32)
+        root.attrs['WholeExtent'] = extent.reshape(-1)
+        root.attrs['Origin'] = np.array(origin, dtype=np.float64)
+        root.attrs['Spacing'] = np.ones(3)
+        root.attrs['Direction'] = np.array(direction, dtype=np.float64)
+        group = root.create_group('PointData')
+        for name, array in point_data:
+            # (z, y, x), or (y, x) for a single slice as vtkHDFReader expects,
+            # in chunks of whole x rows
+            rows = array.reshape(nz * ny, nx)
+            shape = (ny, nx) if nz == 1 else (nz, ny, nx)
+            step = max(1, encoding.chunk_rows // max(nx, 1))
+            options = encoding.dataset_options(rows.shape)
+            if 'chunks' in options:
+                options['chunks'] = (1,) * (len(shape) - 2) + (min(ny, step), nx)
+            dtype = data_type(array)
+            dataset = group.create_dataset(name, shape=shape, dtype=dtype, **options)
+            for z in range(nz):
+                for y in range(0, ny, step):
+                    block = np.asarray(rows[z * ny + y:z * ny + min(ny, y + step)], dtype=dtype)
+                    dataset[(z,) * (len(shape) - 2) + (slice(y, y + step),)] = block
+        root.create_group('CellData')
+        root.create_group('FieldData')
+
+
+class TemporalHDFWriter(object):
+    def __init__(self, filename, points, values, incremental=False, limit=0, collate_frames=1,
+                 encoding=None):
+        '''
+        Writes the frame windows of TemporalVtuWriter as the time steps of one filename.vtkhdf
+        (VTKHDF 2.x), which ParaView (5.12+) opens as a time series.
+        Each localization is stored once, in file order. A time step refers to a range of rows:
+        [start of window, end of window) or, if incremental, [0, end of window), so cumulative
+        views cost no extra space. The time value of a step is its number in the TemporalVtuWriter
+        file names.
+        Needs h5py.
+        :param values: N x k, the last column holds the frame number and is written as
+            point_values_array
+        :param encoding: HDFEncoding of the points and values
+        '''
+        _require_h5py()
+        self._encoding = encoding or HDFEncoding()
+        from smlmvis.vtuwriter import frame_windows
+        self._filename = "{}.vtkhdf".format(filename)
+        self._windows = frame_windows(values[:, -1], incremental, limit, collate_frames)
+        self._write(points, values[:, -1])
+
+    def _write(self, points, values):
+        steps = len(self._windows)
+        frames = np.array([frame for frame, _, _ in self._windows], dtype=np.float64)
+        starts = np.array([lo for _, lo, _ in self._windows], dtype=np.int64)
+        counts = np.array([hi - lo for _, lo, hi in self._windows], dtype=np.int64)
+        ones = np.ones(steps, dtype=np.int64)
+        with h5py.File(self._filename, 'w') as f:
+            root = _root(f, 'UnstructuredGrid')
+            _dataset(root, 'Points', points, np.float32, self._encoding)
+            _dataset(root.create_group('PointData'), 'point_values_array', values, np.float64,
+                     self._encoding)
+            root.create_group('CellData')
+            root.create_group('FieldData')
+            # Each step is one poly vertex over its points,
+            # numbered from 0 so all share one connectivity array
+            root.create_dataset('Connectivity',
+                                data=np.arange(counts.max() if steps else 0, dtype=np.int64))
+            offsets = np.zeros((steps, 2), dtype=np.int64)
+            offsets[:, 1] = counts
+            root.create_dataset('Offsets', data=offsets.reshape(-1))
+            root.create_dataset('Types', data=np.full(steps, VTK_POLY_VERTEX, dtype=np.uint8))
+            root.create_dataset('NumberOfPoints', data=counts)
+            root.create_dataset('NumberOfCells', data=ones)
+            root.create_dataset('NumberOfConnectivityIds', data=counts)
+            group = root.create_group('Steps')
+            group.attrs['NSteps'] = steps
+            group.create_dataset('Values', data=frames)
+            group.create_dataset('PartOffsets', data=np.arange(steps, dtype=np.int64))
+            group.create_dataset('NumberOfParts', data=ones)
+            group.create_dataset('PointOffsets', data=starts)
+            group.create_dataset('CellOffsets', data=np.arange(steps, dtype=np.int64))
+            group.create_dataset('ConnectivityIdOffsets', data=np.zeros(steps, dtype=np.int64))
+            group.create_group('PointDataOffsets').create_dataset('point_values_array', data=starts)
+            group.create_group('CellDataOffsets')
+            group.create_group('FieldDataOffsets')
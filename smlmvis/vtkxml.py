@@ -0,0 +1,535 @@
+import os
+import sys
+import zlib
+import tempfile
+import lzma
+import base64
+from xml.sax.saxutils import escape
+import numpy as np
+import logging
+from smlmvis.encoding import Encoding
+logger = logging.getLogger('global')
+try:
+    import lz4.block
+except ImportError:
+    lz4 = None
+
+# VTK cell types
+VTK_VERTEX = 1
+VTK_POLY_VERTEX = 2
+VTK_LINE = 3
+VTK_TETRA = 10
+
+_TYPES = {'int8': 'Int8', 'uint8': 'UInt8', 'int16': 'Int16', 'uint16': 'UInt16',
+          'int32': 'Int32', 'uint32': 'UInt32', 'int64': 'Int64', 'uint64': 'UInt64',
+          'float32': 'Float32', 'float64': 'Float64'}
+_BLOCK_SIZE = 32768
+# Width reserved for offsets that are filled in after the data is written, as vtkXMLWriter does
+_OFFSET_WIDTH = 20
+
+
+def data_type(array):
+    '''
+    :return: dtype array is stored as, its own if VTK has it,
+        else float64 (floats) or uint8 (booleans)
+    '''
+    if array.dtype.name in _TYPES:
+        return array.dtype
+    return np.dtype(np.uint8) if array.dtype.kind == 'b' else np.dtype(np.float64)
+
+
+class IndexRange(object):
+    '''
+    start, start+1, ... stop-1 as int64, generated one chunk at a time.
+    Stands in for np.arange(start, stop) in a DataArray without allocating it.
+    '''
+    def __init__(self, start, stop):
+        self._start = start
+        self.shape = (stop - start,)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __array__(self, dtype=None, copy=None):
+        return np.arange(self._start, self._start + self.shape[0], dtype=dtype or np.int64)
+
+    def __getitem__(self, rows):
+        lo, hi, _ = rows.indices(self.shape[0])
+        return np.arange(self._start + lo, self._start + hi, dtype=np.int64)
+
+
+class DataArray(object):
+    '''
+    A named array of the file, converted to dtype one chunk of rows at a time while it is written.
+    '''
+    def __init__(self, name, array, dtype):
+        '''
+        :param name: Name attribute, None for the Points array
+        :param array: N or N x k array (or IndexRange), rows are tuples
+        :param dtype: type stored in the file
+        '''
+        self.name = name
+        self.array = array
+        self.dtype = np.dtype(dtype)
+        self.components = 1 if len(array.shape) == 1 else array.shape[1]
+
+    def __len__(self):
+        return self.array.shape[0]
+
+    @property
+    def nbytes(self):
+        return len(self) * self.components * self.dtype.itemsize
+
+    def attributes(self):
+        attributes = 'type="{}"'.format(_TYPES[self.dtype.name])
+        if self.name is not None:
+            attributes += ' Name="{}"'.format(escape(self.name, {'"': '&quot;'}))
+        if self.components != 1 or self.name is None:
+            attributes += ' NumberOfComponents="{}"'.format(self.components)
+        return attributes
+
+    def chunks(self, rows):
+        '''
+        :param rows: Number of rows converted at once
+        :return: generator of byte views on contiguous chunks
+        '''
+        for start in range(0, len(self), rows):
+            chunk = np.ascontiguousarray(self.array[start:start + rows], dtype=self.dtype)
+            yield memoryview(chunk).cast('B')
+
+
+class _Base64Stream(object):
+    '''
+    Base64 encodes the bytes written to it as one stream, in pieces that are multiples of 3 bytes.
+    '''
+    def __init__(self, f):
+        self._f = f
+        self._rest = b''
+
+    def write(self, data):
+        data = self._rest + bytes(data)
+        cut = len(data) - len(data) % 3
+        self._f.write(base64.b64encode(data[:cut]))
+        self._rest = data[cut:]
+
+    def close(self):
+        self._f.write(base64.b64encode(self._rest))
+        self._rest = b''
+
+
+def _check_compressor(compressor):
+    if compressor == 'lz4' and lz4 is None:
+        raise ImportError('lz4 compression with the numpy backend needs the lz4 package')
+
+
+class _Compressor(object):
+    def __init__(self, compressor, level):
+        _check_compressor(compressor)
+        self._compressor = compressor
+        self._level = level
+
+    def __call__(self, block):
+        if self._compressor == 'zlib':
+            return zlib.compress(block, -1 if self._level is None else self._level)
+        if self._compressor == 'lzma':
+            return lzma.compress(block, format=lzma.FORMAT_XZ, check=lzma.CHECK_CRC64,
+                                 preset=6 if self._level is None else self._level)
+        return lz4.block.compress(block, store_size=False)
+
+
+class _ArrayEncoder(object):
+    '''
+    Writes the bytes of one array to out as they arrive,
+    compressed in blocks of the encoding block size.
+    Blocks span the pieces passed to write, only the bytes of an incomplete block are kept.
+    The header that goes before the data is only known after close, see header().
+    '''
+    def __init__(self, out, encoding):
+        self._out = out
+        self._compress = None
+        if encoding.compressor != 'none':
+            self._compress = _Compressor(encoding.compressor, encoding.level)
+        self._blocksize = encoding.block_size or _BLOCK_SIZE
+        self._pending = b''
+        self._sizes = []
+        self.nbytes = 0
+
+    def _emit(self, block):
+        compressed = self._compress(block)
+        self._sizes.append(len(compressed))
+        self._out.write(compressed)
+
+    def write(self, data):
+        self.nbytes += len(data)
+        if self._compress is None:
+            self._out.write(data)
+            return
+        if self._pending:
+            need = self._blocksize - len(self._pending)
+            self._pending += bytes(data[:need])
+            data = data[need:]
+            if len(self._pending) < self._blocksize:
+                return
+            self._emit(self._pending)
+        full = len(data) - len(data) % self._blocksize
+        for i in range(0, full, self._blocksize):
+            self._emit(data[i:i + self._blocksize])
+        self._pending = bytes(data[full:])
+
+    def close(self):
+        if self._pending:
+            self._emit(self._pending)
+            self._pending = b''
+
+    def header(self):
+        '''
+        :return: UInt64 header, [nbytes] uncompressed,
+            [nblocks, blocksize, lastblocksize, compressed sizes] compressed
+        '''
+        if self._compress is None:
+            return np.array([self.nbytes], dtype=np.uint64)
+        sizes = [len(self._sizes), self._blocksize, self.nbytes % self._blocksize] + self._sizes
+        return np.array(sizes, dtype=np.uint64)
+
+
+def _header_size(nbytes, encoding):
+    if encoding.compressor == 'none':
+        return 1
+    return 3 + -(-nbytes // (encoding.block_size or _BLOCK_SIZE))
+
+
+def write_appended(f, data_array, encoding, chunk_rows):
+    '''
+    Write data_array as one entry of the appended section,
+    in the layout of vtkXMLWriter with a UInt64 header.
+    With base64 the header and the data are encoded together if uncompressed,
+    separately if compressed.
+    '''
+    out = f if encoding.raw else _Base64Stream(f)
+    encoder = _ArrayEncoder(out, encoding)
+    # The compressed sizes are only known afterwards, the header is patched in place
+    start = f.tell()
+    header = np.zeros(_header_size(data_array.nbytes, encoding), dtype=np.uint64)
+    header[0] = data_array.nbytes
+    _write_header(f, out, header, encoding)
+    for chunk in data_array.chunks(chunk_rows):
+        encoder.write(chunk)
+    encoder.close()
+    if not encoding.raw:
+        out.close()
+    if encoding.compressor != 'none':
+        end = f.tell()
+        f.seek(start)
+        _write_header(f, out, encoder.header(), encoding)
+        f.seek(end)
+
+
+def _write_header(f, out, header, encoding):
+    if encoding.compressor != 'none' and not encoding.raw:
+        f.write(base64.b64encode(header.tobytes()))
+    else:
+        out.write(header.tobytes())
+
+
+def copy_appended(f, encoder, spool, encoding, blocksize=1 << 24):
+    '''
+    Write the header of encoder and the data it wrote to spool (a file)
+    as one entry of the appended section
+    '''
+    out = f if encoding.raw else _Base64Stream(f)
+    _write_header(f, out, encoder.header(), encoding)
+    spool.seek(0)
+    block = spool.read(blocksize)
+    while block:
+        out.write(block)
+        block = spool.read(blocksize)
+    if not encoding.raw:
+        out.close()
+
+
+class XMLWriter(object):
+    '''
+    Streams a VTK XML file straight from numpy arrays, without vtk.
+    All arrays go in the appended section and are converted and written chunk by chunk,
+    so the only extra memory is one chunk (and one compressed block).
+    '''
+    def __init__(self, filename, dataset, encoding=None, chunk_rows=1 << 20, attributes=None):
+        '''
+        :param filename: Path of the file, with extension
+        :param dataset: 'UnstructuredGrid', 'PolyData' or 'ImageData'
+        :param encoding: Encoding, only the appended data mode is supported
+        :param chunk_rows: Number of rows of an array converted and written at once
+        :param attributes: dict of attributes of the dataset element,
+            e.g. the WholeExtent of ImageData
+        '''
+        self._filename = filename
+        self._dataset = dataset
+        self._dataset_attributes = attributes or {}
+        self._encoding = encoding or Encoding()
+        if self._encoding.data_mode != 'appended':
+            raise ValueError('The numpy backend only writes appended data, not {}'.format(
+                self._encoding.data_mode))
+        # Fail before a file is created
+        _check_compressor(self._encoding.compressor)
+        self._chunk_rows = chunk_rows
+
+    def write(self, piece, sections):
+        '''
+        :param piece: dict of Piece attributes, e.g. {'NumberOfPoints': n, 'NumberOfCells': m}
+        :param sections: list of (tag, attributes dict, list of DataArray),
+            e.g. ('PointData', {'Scalars': name}, [...])
+        '''
+        with open(self._filename, 'wb') as f:
+            arrays = self._begin(f, piece, sections)
+            for data_array in arrays:
+                self._next(f)
+                write_appended(f, data_array, self._encoding, self._chunk_rows)
+            self._end(f, piece)
+
+    def _begin(self, f, piece, sections):
+        '''
+        Write the XML up to the start of the appended data,
+        with room for the piece attributes and the offsets.
+        :return: the DataArrays in sections, in the order their data has to be written
+        '''
+        byte_order = 'LittleEndian' if sys.byteorder == 'little' else 'BigEndian'
+        compressor = {'none': '', 'zlib': ' compressor="vtkZLibDataCompressor"',
+                      'lz4': ' compressor="vtkLZ4DataCompressor"',
+                      'lzma': ' compressor="vtkLZMADataCompressor"'}[self._encoding.compressor]
+
+        def line(text):
+            f.write((text + '\n').encode('utf-8'))
+
+        def xml_attributes(attributes):
+            return ''.join(' {}="{}"'.format(k, escape(str(v), {'"': '&quot;'}))
+                           for k, v in attributes.items())
+        line('<?xml version="1.0"?>')
+        line('<VTKFile type="{}" version="1.0" byte_order="{}" header_type="UInt64"{}>'.format(
+            self._dataset, byte_order, compressor))
+        line('  <{}{}>'.format(self._dataset, xml_attributes(self._dataset_attributes)))
+        f.write(b'    <Piece')
+        self._attributes = {}
+        for key, value in piece.items():
+            f.write(' {}="'.format(key).encode('ascii'))
+            width = max(_OFFSET_WIDTH, len(str(value)))
+            self._attributes[key] = (f.tell(), width)
+            f.write(b' ' * (width + 1))
+        line('>')
+        self._placeholders, arrays = [], []
+        for tag, attributes, data_arrays in sections:
+            line('      <{}{}>'.format(tag, xml_attributes(attributes)))
+            for data_array in data_arrays:
+                f.write('        <DataArray {} format="appended" offset="'.format(
+                    data_array.attributes()).encode('utf-8'))
+                self._placeholders.append(f.tell())
+                arrays.append(data_array)
+                line(' ' * (_OFFSET_WIDTH + 1) + '/>')
+            line('      </{}>'.format(tag))
+        line('    </Piece>')
+        line('  </{}>'.format(self._dataset))
+        line('  <AppendedData encoding="{}">'.format('raw' if self._encoding.raw else 'base64'))
+        f.write(b'   _')
+        self._start = f.tell()
+        self._offsets = []
+        return arrays
+
+    def _next(self, f):
+        '''
+        Mark the start of the data of the next array
+        '''
+        self._offsets.append(f.tell() - self._start)
+
+    def _end(self, f, piece):
+        '''
+        Close the file and fill in the piece attributes
+        (which can differ from those given to _begin) and offsets
+        '''
+        f.write(b'\n  </AppendedData>\n</VTKFile>\n')
+        for key, value in piece.items():
+            position, width = self._attributes[key]
+            f.seek(position)
+            f.write('{}"'.format(value).ljust(width + 1).encode('ascii'))
+        for position, offset in zip(self._placeholders, self._offsets):
+            f.seek(position)
+            f.write('{}"'.format(offset).ljust(_OFFSET_WIDTH + 1).encode('ascii'))
+        f.seek(0, 2)
+
+
+class PointStream(XMLWriter):
+    '''
+    A .vtu of points and point data that arrive in chunks, with all points in one poly vertex cell.
+    open() writes the XML with room for the number of points and the offsets,
+    which close() fills in.
+    Arrays are encoded as chunks arrive. With raw uncompressed encoding the points go straight into
+    the appended section, everything else goes to temporary files next to filename which close()
+    copies in, so memory use does not depend on the number of points.
+    '''
+    def __init__(self, filename, point_data, encoding=None):
+        '''
+        :param filename: Path of the file, with extension
+        :param point_data: list of (name, dtype, number of components), the first is set as Scalars
+        '''
+        super().__init__(filename, 'UnstructuredGrid', encoding)
+        self._point_data = point_data
+        self._f = None
+
+    def open(self):
+        if self._f is not None:
+            raise ValueError('{} is already open'.format(self._filename))
+        self._count = 0
+        shapes = [(0,) if components == 1 else (0, components)
+                  for _, _, components in self._point_data]
+        self._arrays = [DataArray(None, np.empty((0, 3)), np.float32)] + \
+            [DataArray(name, np.empty(shape), dtype)
+             for (name, dtype, _), shape in zip(self._point_data, shapes)]
+        self._direct = self._encoding.raw and self._encoding.compressor == 'none'
+        directory = os.path.dirname(os.path.abspath(self._filename))
+        self._spools = []
+        self._f = open(self._filename, 'wb')
+        try:
+            self._begin(self._f, self._piece(), self._sections())
+            for index in range(len(self._arrays)):
+                self._spools.append(None if (index == 0 and self._direct)
+                                    else tempfile.TemporaryFile(dir=directory))
+            if self._direct:
+                self._next(self._f)
+                self._header = self._f.tell()
+                self._f.write(np.zeros(1, dtype=np.uint64).tobytes())
+            self._encoders = [_ArrayEncoder(spool or self._f, self._encoding)
+                              for spool in self._spools]
+        except BaseException:
+            # Leave no partial file behind, and allow open() again
+            for spool in self._spools:
+                if spool is not None:
+                    spool.close()
+            self._f.close()
+            self._f = None
+            os.remove(self._filename)
+            raise
+
+    def _piece(self):
+        return {'NumberOfPoints': self._count, 'NumberOfCells': 1}
+
+    def _sections(self):
+        # Points first, their data can then be written before the point data is complete
+        names = [name for name, _, _ in self._point_data]
+        return [('Points', {}, self._arrays[:1]),
+                ('PointData', {'Scalars': names[0]} if names else {}, self._arrays[1:]),
+                ('Cells', {}, [DataArray('connectivity', IndexRange(0, 0), np.int64),
+                               DataArray('offsets', np.empty(1), np.int64),
+                               DataArray('types', np.empty(1), np.uint8)])]
+
+    def append(self, points, point_data):
+        '''
+        :param points: n x 3 array
+        :param point_data: list of arrays with n rows,
+            in the order of the point_data given to the constructor
+        '''
+        if self._f is None:
+            raise ValueError('{} is not open'.format(self._filename))
+        if len(point_data) != len(self._point_data) or \
+                any(len(a) != len(points) for a in point_data):
+            raise ValueError('Expected {} arrays of {} rows'.format(len(self._point_data),
+                                                                    len(points)))
+        arrays = [points] + list(point_data)
+        for data_array, encoder, array in zip(self._arrays, self._encoders, arrays):
+            chunk = np.ascontiguousarray(array, dtype=data_array.dtype)
+            encoder.write(memoryview(chunk).cast('B'))
+        self._count += len(points)
+
+    def close(self):
+        if self._f is None:
+            return
+        f = self._f
+        for index, (encoder, spool) in enumerate(zip(self._encoders, self._spools)):
+            encoder.close()
+            if spool is None:
+                end = f.tell()
+                f.seek(self._header)
+                f.write(encoder.header().tobytes())
+                f.seek(end)
+            else:
+                self._next(f)
+                copy_appended(f, encoder, spool, self._encoding)
+                spool.close()
+        for data_array in [DataArray('connectivity', IndexRange(0, self._count), np.int64),
+                           DataArray('offsets', np.array([self._count]), np.int64),
+                           DataArray('types', np.array([VTK_POLY_VERTEX]), np.uint8)]:
+            self._next(f)
+            write_appended(f, data_array, self._encoding, self._chunk_rows)
+        self._end(f, self._piece())
+        f.close()
+        self._f = None
+
+
+def write_unstructured_grid(filename, points, point_data, cells, cell_data=(), encoding=None,
+                            chunk_rows=1 << 20):
+    '''
+    Write a .vtu file without vtk.
+    :param points: N x 3 array, stored as float32
+    :param point_data: list of (name, array) with N rows, the first is set as Scalars
+    :param cells: (types, offsets, connectivity),
+        offsets has one entry per cell plus a leading 0 as in vtkCellArray
+    :param cell_data: list of (name, array) with one row per cell
+    '''
+    types, offsets, connectivity = cells
+    point_arrays = [DataArray(name, array, data_type(array))
+                    for name, array in point_data]
+    cell_arrays = [DataArray(name, array, data_type(array))
+                   for name, array in cell_data]
+    sections = [('PointData', {'Scalars': point_data[0][0]} if point_data else {}, point_arrays),
+                ('CellData', {'Scalars': cell_data[0][0]} if cell_data else {}, cell_arrays),
+                ('Points', {}, [DataArray(None, points, np.float32)]),
+                ('Cells', {}, [DataArray('connectivity', connectivity, np.int64),
+                               DataArray('offsets', _ends(offsets), np.int64),
+                               DataArray('types', types, np.uint8)])]
+    XMLWriter(filename, 'UnstructuredGrid', encoding, chunk_rows).write(
+        {'NumberOfPoints': len(points), 'NumberOfCells': len(types)}, sections)
+
+
+def _ends(offsets):
+    '''
+    :return: offsets without the leading 0, the layout of the offsets array in VTK XML files
+    '''
+    if isinstance(offsets, IndexRange):
+        return IndexRange(offsets._start + 1, offsets._start + len(offsets))
+    return offsets[1:]
+
+
+def write_polydata(filename, points, point_data, verts, lines, encoding=None, chunk_rows=1 << 20):
+    '''
+    Write a .vtp file without vtk.
+    :param points: N x 3 array, stored as float32
+    :param point_data: list of (name, array) with N rows, the first is set as Scalars
+    :param verts: (offsets, connectivity) of the vertex cells, in vtkCellArray layout
+    :param lines: (offsets, connectivity) of the line cells
+    '''
+    point_arrays = [DataArray(name, array, data_type(array))
+                    for name, array in point_data]
+    sections = [('PointData', {'Scalars': point_data[0][0]} if point_data else {}, point_arrays),
+                ('Points', {}, [DataArray(None, points, np.float32)])]
+    for tag, (offsets, connectivity) in (('Verts', verts), ('Lines', lines)):
+        sections.append((tag, {}, [DataArray('connectivity', connectivity, np.int64),
+                                   DataArray('offsets', _ends(offsets), np.int64)]))
+    XMLWriter(filename, 'PolyData', encoding, chunk_rows).write(
+        {'NumberOfPoints': len(points), 'NumberOfVerts': len(verts[0]) - 1,
+         'NumberOfLines': len(lines[0]) - 1, 'NumberOfStrips': 0, 'NumberOfPolys': 0}, sections)
+
+
+def write_image_data(filename, shape, origin, direction, point_data, encoding=None,
+                     chunk_rows=1 << 20):
+    '''
+    Write a .vti file without vtk.
+    :param shape: number of points along (x, y, z), x varies fastest in the arrays
+    :param origin: position of point (0, 0, 0)
+    :param direction: 9 values, the 3 x 3 matrix (row by row) that maps the image axes to x, y, z.
+        Spacing is 1.
+    :param point_data: list of (name, array) with one row per point, the first is set as Scalars
+    '''
+    extent = ' '.join('0 {}'.format(n - 1) for n in shape)
+    point_arrays = [DataArray(name, array, data_type(array)) for name, array in point_data]
+    sections = [('PointData', {'Scalars': point_data[0][0]} if point_data else {}, point_arrays)]
+    attributes = {'WholeExtent': extent, 'Origin': ' '.join(str(x) for x in origin),
+                  'Spacing': '1 1 1', 'Direction': ' '.join(str(x) for x in direction)}
+    XMLWriter(filename, 'ImageData', encoding, chunk_rows, attributes).write({'Extent': extent},
+                                                                             sections)
@@ -1,266 +1,782 @@
-import vtk
+import os
+import sys
+import time
+import tempfile
+import importlib.util
 import numpy as np
+import logging
+from scipy import sparse
+from smlmvis.encoding import Encoding, HDFEncoding, default_settings, default_hdf_settings
+from smlmvis.parallel import process_pool, to_shared, from_shared, share, attach
+from smlmvis import vtkhdf
+from smlmvis.vtkxml import IndexRange, DataArray, PointStream, write_unstructured_grid, \
+    write_polydata, write_image_data, data_type, VTK_VERTEX, VTK_POLY_VERTEX, VTK_LINE, VTK_TETRA
+logger = logging.getLogger('global')
+
+BACKENDS = ('vtk', 'numpy', 'hdf')
+EXTENSIONS = {'vtk': '.vtu', 'numpy': '.vtu', 'hdf': '.vtkhdf'}
+POLYDATA_EXTENSIONS = {'vtk': '.vtp', 'numpy': '.vtp', 'hdf': '.vtkhdf'}
+IMAGE_EXTENSIONS = {'vtk': '.vti', 'numpy': '.vti', 'hdf': '.vtkhdf'}
+# vtk is only imported when a file is written with the vtk backend
+DEFAULT_BACKEND = 'vtk' if importlib.util.find_spec('vtk') is not None else 'numpy'
+
+
+def poly_vertex_cells(n, start=0):
+    '''
+    A single poly vertex cell over points start - start+n
+    :return: cell types, offsets, connectivity as numpy arrays (connectivity as an IndexRange)
+    '''
+    types = np.array([VTK_POLY_VERTEX], dtype=np.uint8)
+    offsets = np.array([0, n], dtype=np.int64)
+    return types, offsets, IndexRange(start, start + n)
+
+
+def channel_cells(counts):
+    '''
+    One poly vertex cell per channel, over the consecutive points of the channels
+    :param counts: number of points of each channel
+    :return: cell types, offsets, connectivity as numpy arrays (connectivity as an IndexRange)
+    '''
+    offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    types = np.full(len(counts), VTK_POLY_VERTEX, dtype=np.uint8)
+    return types, offsets, IndexRange(0, int(offsets[-1]))
+
+
+def channel_offsets(pointset):
+    '''
+    :param pointset: list of n_i x 3 arrays, as given to KChannelVtuWriter
+    :return: index of the first point of each set in the written points,
+        the offsets of the NNWriter edges
+    '''
+    return channel_cells([len(points) for points in pointset])[1][:-1]
+
+
+def uniform_cells(celltype, connectivity):
+    '''
+    M cells of the same type with k points each
+    :param connectivity: M x k array of point indices
+    :return: cell types, offsets, connectivity as numpy arrays
+    '''
+    m, k = connectivity.shape
+    types = np.full(m, celltype, dtype=np.uint8)
+    offsets = np.arange(0, m * k + 1, k, dtype=np.int64)
+    return types, offsets, connectivity.reshape(-1)
+
+
+def frame_windows(frames, incremental=False, limit=0, collate_frames=1):
+    '''
+    The slices TemporalVtuWriter writes. A window starts at the first row whose frame exceeds the
+    first frame of the previous window by collate_frames or more (the first window starts at
+    frame 1), and is written when the next one starts, numbered with the frame before that.
+    Boundaries are found with a binary search on the running maximum of the frames, one per window.
+    :param frames: frame number of each row
+    :return: list of (number, first row, end row)
+    '''
+    skipframes = 1 if collate_frames <= 1 else collate_frames
+    frames = np.asarray(frames).astype(np.int64)
+    # the first row with frame > t is the first row where the running maximum exceeds t
+    runmax = np.maximum.accumulate(frames) if len(frames) else frames
+    windows = []
+    lastframe, lastindex = 1, 0
+    while True:
+        index = int(np.searchsorted(runmax, lastframe + skipframes - 1, side='right'))
+        if index == len(frames):
+            break
+        fnumber = int(frames[index])
+        windows.append((fnumber - 1, 0 if incremental else lastindex, index))
+        lastframe, lastindex = fnumber, index
+        if limit != 0 and fnumber > limit:
+            break
+    return windows
+
+
+def _write_windows(handles, names, windows, encoding, backend, polydata):
+    '''
+    :param handles: share handles of points, values and the point_data arrays called names
+    '''
+    shms, arrays = zip(*[attach(handle) for handle in handles])
+    try:
+        for sfname, lo, hi in windows:
+            point_data = [(name, array[lo:hi]) for name, array in zip(names, arrays[2:])]
+            VtuWriter(sfname, arrays[0][lo:hi, :], arrays[1][lo:hi, :], encoding=encoding,
+                      backend=backend, polydata=polydata, point_data=point_data)
+    finally:
+        del arrays
+        for shm in shms:
+            shm.close()
+
+
+def _vtk_array(array, dtype, keep, array_type=None):
+    '''
+    Wrap array as a vtk array without a copy.
+    numpy_to_vtk does not copy, the arrays have to outlive the writer, so they are appended to keep.
+    '''
+    from vtk.util import numpy_support
+    array = np.ascontiguousarray(array, dtype=dtype)
+    keep.append(array)
+    return numpy_support.numpy_to_vtk(array, deep=False, array_type=array_type)
+
+
+def _vtk_attributes(attributes, data, keep):
+    '''
+    Add the named arrays of data to vtkPointData or vtkCellData, the first one as the scalars.
+    :param data: list of (name, array)
+    '''
+    for index, (name, array) in enumerate(data):
+        varray = _vtk_array(array, data_type(array), keep)
+        varray.SetName(name)
+        if index == 0:
+            attributes.SetScalars(varray)
+        else:
+            attributes.AddArray(varray)
+
 
 class TemporalVtuWriter(object):
-    def __init__(self, filename, points, values, incremental=False, limit=0, collate_frames=1):
+    def __init__(self, filename, points, values, incremental=False, limit=0, collate_frames=1,
+                 encoding=None, backend=None, max_workers=1, polydata=False, point_data=None):
         '''
         Writes filename<number>.vtu of points, values sliced along frames.
         The slicenumber corresponds with the last fields of the k-tuple in values.
+        :param encoding: Encoding of the files, see VtuWriter
+        :param backend: 'vtk', 'numpy' or 'hdf', see VtuWriter
+        :param polydata: If true, write filename<number>.vtp point clouds, see VtuWriter
+        :param point_data: list of (name, array) added to each file, sliced as points, see VtuWriter
+        :param max_workers: Number of processes writing files, None for the number of cores.
+            1 (default) writes in this process, a pool only pays off for many or large windows.
         '''
+        self._encoding = encoding
+        self._backend = backend
+        self._polydata = polydata
+        self._max_workers = max_workers
         self._filename = filename
         self._points = points
         self._values = values
+        self._pointData = point_data or []
         self._incremental = incremental
         self._limit = limit
         self._skipframes = 1 if collate_frames <= 1 else collate_frames
         self._writeAll()
 
     def _writeAll(self):
-        fname = self._filename
-        # find out if doing binary split 40k times is more efficient
-        lastframe = 1
-        lastindex = 0
-        for index, (point, value) in enumerate(zip(self._points, self._values)):
-            fnumber = int(value[-1])
-            if fnumber > lastframe + self._skipframes - 1:
-                # print("New framenumber from {} to {} with index going from {} to {}".format(lastframe, fnumber, lastindex, index))
-                l = 0 if self._incremental else lastindex
-                p, v = self._points[l:index, :], self._values[l:index, :]
-                sfname = "{}{}".format(fname, fnumber-1)
-                VtuWriter(sfname, p, v)
-                lastframe, lastindex = fnumber, index
-                if self._limit != 0 and fnumber > self._limit:
-                    return
+        windows = [("{}{}".format(self._filename, frame), lo, hi) for frame, lo, hi in
+                   frame_windows(self._values[:, -1], self._incremental, self._limit,
+                                 self._skipframes)]
+        if not windows:
+            return
+        workers = min(self._max_workers or os.cpu_count() or 1, len(windows))
+        if workers == 1:
+            for sfname, lo, hi in windows:
+                VtuWriter(sfname, self._points[lo:hi, :], self._values[lo:hi, :],
+                          encoding=self._encoding, backend=self._backend, polydata=self._polydata,
+                          point_data=[(name, array[lo:hi]) for name, array in self._pointData])
+            return
+        names = [name for name, _ in self._pointData]
+        arrays = [self._points, self._values] + [array for _, array in self._pointData]
+        blocks = [share(array) for array in arrays]
+        handles = [handle for _, handle in blocks]
+        try:
+            with process_pool(workers) as pool:
+                # Interleaved batches,
+                # so early (small) and late (large, when incremental) windows are spread out
+                futures = [pool.submit(_write_windows, handles, names, windows[i::workers],
+                                       self._encoding, self._backend, self._polydata)
+                           for i in range(workers)]
+                for future in futures:
+                    future.result()
+        finally:
+            for shm, _ in blocks:
+                shm.close()
+                shm.unlink()
 
 
 class VtuWriter(object):
-    def __init__(self, filename, points, values):
+    '''
+    Writers describe the dataset as numpy arrays (points, named point and cell data,
+    cells in vtkCellArray layout), which a backend writes: 'vtk' builds a vtkUnstructuredGrid on
+    the arrays without copying them and writes it with vtkXMLUnstructuredGridWriter, 'numpy' streams
+    the XML from the arrays (see vtkxml) and does not need vtk, 'hdf' writes a chunked VTKHDF file
+    with h5py (see vtkhdf) instead of XML.
+    The default is DEFAULT_BACKEND.
+    Writers whose cells are only (poly) vertices and lines can write PolyData (polydata=True)
+    instead of an UnstructuredGrid, with one vertex cell per point, which ParaView loads and
+    renders faster.
+    Besides point_values_array, writers can attach any number of named point arrays (point_data)
+    in the same file, e.g. every value column of a reader, so one file can be colored by each of
+    them.
+    '''
+    _value_column = -1
+
+    def __init__(self, filename, points, values, encoding=None, backend=None, polydata=False,
+                 point_data=None):
         '''
-        Appends .vtu to filename
+        Appends .vtu to filename (.vtp with polydata, .vtkhdf for the hdf backend)
+        :param values: N x k array, the last column is written as point_values_array.
+            None to write only point_data.
+        :param encoding: Encoding of the arrays in the file, defaults to appended base64 with zlib.
+            HDFEncoding for the hdf backend, defaults to uncompressed.
+        :param backend: 'vtk', 'numpy' or 'hdf', defaults to DEFAULT_BACKEND
+        :param polydata: If true, write a PolyData point cloud with one vertex per point
+        :param point_data: list of (name, array of N values or tuples) written as named point arrays
+            in their own type, e.g. reader.point_data(). Contiguous arrays are written without a
+            copy.
         '''
-        self._points= vtk.vtkPoints()
-        self._grid = vtk.vtkUnstructuredGrid()
-        self._values = vtk.vtkDoubleArray()
-        self._values.SetName('point_values_array')
-        self._grid.SetPoints(self._points)
-        self._grid.GetPointData().SetScalars(self._values)
+        self._setup(encoding, backend, polydata)
         self._loadPoints(points, values)
-        self._write("{}.vtu".format(filename))
+        for name, array in point_data or []:
+            self._addPointData(name, array)
+        self._write(filename)
+
+    def _setup(self, encoding, backend, polydata=False):
+        self._polydata = polydata
+        self._backend = backend or DEFAULT_BACKEND
+        if self._backend not in BACKENDS:
+            raise ValueError('Backend should be one of {}, not {}'.format(BACKENDS, self._backend))
+        kind = HDFEncoding if self._backend == 'hdf' else Encoding
+        self._encoding = encoding or kind()
+        if not isinstance(self._encoding, kind):
+            raise ValueError('The {} backend needs a {}, not {}'.format(
+                self._backend, kind.__name__, self._encoding))
+        self._points = None
+        self._pointData = []
+        self._cellData = []
+        self._cells = []
 
     def _loadPoints(self, points, values):
-        poly = vtk.vtkPolyVertex()
-        poly.GetPointIds().SetNumberOfIds(points.shape[0])
-        for i, (point, value) in enumerate(zip(points, values)):
-            poly.GetPointIds().SetId(i, self._points.InsertNextPoint(point))
-            self._values.InsertNextValue(values[i][-1])
-        self._grid.InsertNextCell(poly.GetCellType(), poly.GetPointIds())
+        self._setPoints(points)
+        if values is not None:
+            self._addPointData('point_values_array', values[:, self._value_column])
+        self._addCells(*poly_vertex_cells(points.shape[0]))
+
+    def _setPoints(self, points):
+        self._points = points
+
+    def _addPointData(self, name, array):
+        '''
+        :param array: 1 value or tuple per point. The first array added is the active scalar.
+        '''
+        if any(name == other for other, _ in self._pointData):
+            raise ValueError('Point data {} is added twice'.format(name))
+        self._pointData.append((name, np.asarray(array)))
+
+    def _addCellData(self, name, array):
+        self._cellData.append((name, array))
+
+    def _addCells(self, types, offsets, connectivity):
+        '''
+        Add cells after those already added
+        :param offsets: start of each cell in connectivity plus the end of the last,
+            as in vtkCellArray
+        '''
+        self._cells.append((types, offsets, connectivity))
+
+    def _cellArrays(self):
+        '''
+        :return: types, offsets, connectivity of all cells
+        '''
+        if len(self._cells) == 1:
+            return self._cells[0]
+        if not self._cells:
+            return (np.empty(0, dtype=np.uint8), np.zeros(1, dtype=np.int64),
+                    np.empty(0, dtype=np.int64))
+        types, offsets, connectivity = zip(*self._cells)
+        ends = np.cumsum([o[-1] for o in offsets])
+        shifted = [np.asarray(offsets[0])] + [np.asarray(o[1:]) + end
+                                              for o, end in zip(offsets[1:], ends[:-1])]
+        return (np.concatenate(types), np.concatenate(shifted),
+                np.concatenate([np.asarray(c) for c in connectivity]))
+
+    def _polyArrays(self):
+        '''
+        :return: (offsets, connectivity) of the verts,
+            one per point of the vertex and poly vertex cells, and of the lines
+        '''
+        if self._cellData:
+            raise ValueError('Cell data can not be written as PolyData')
+        verts, lines = [], []
+        for types, offsets, connectivity in self._cells:
+            if np.all(np.isin(types, (VTK_VERTEX, VTK_POLY_VERTEX))):
+                verts.append(connectivity)
+            elif np.all(np.asarray(types) == VTK_LINE):
+                lines.append((offsets, connectivity))
+            else:
+                raise ValueError('PolyData output only holds vertices and lines')
+        if len(verts) != 1:
+            verts = [np.concatenate([np.asarray(c) for c in verts]) if verts
+                     else np.empty(0, dtype=np.int64)]
+        if len(lines) == 1:
+            lines = lines[0]
+        else:
+            # all lines have 2 points
+            connectivity = np.concatenate([np.asarray(c) for _, c in lines]) if lines \
+                else np.empty(0, dtype=np.int64)
+            lines = (np.arange(0, len(connectivity) + 1, 2, dtype=np.int64), connectivity)
+        return (IndexRange(0, len(verts[0]) + 1), verts[0]), lines
 
     def _write(self, filename):
-        writer = vtk.vtkXMLUnstructuredGridWriter()
+        '''
+        :param filename: path without extension, the extension of the backend is appended
+        '''
+        if self._polydata:
+            filename += POLYDATA_EXTENSIONS[self._backend]
+            if self._backend == 'numpy':
+                write_polydata(filename, self._points, self._pointData, *self._polyArrays(),
+                               encoding=self._encoding)
+            elif self._backend == 'hdf':
+                vtkhdf.write_polydata(filename, self._points, self._pointData, *self._polyArrays(),
+                                      encoding=self._encoding)
+            else:
+                self._writeVtk(filename)
+            return
+        filename += EXTENSIONS[self._backend]
+        if self._backend == 'numpy':
+            write_unstructured_grid(filename, self._points, self._pointData, self._cellArrays(),
+                                    self._cellData, self._encoding)
+        elif self._backend == 'hdf':
+            vtkhdf.write_unstructured_grid(filename, self._points, self._pointData,
+                                           self._cellArrays(), self._cellData, self._encoding)
+        else:
+            self._writeVtk(filename)
+
+    def _writeVtk(self, filename):
+        import vtk
+        keep = []
+
+        def cellArray(offsets, connectivity):
+            cells = vtk.vtkCellArray()
+            # vtkTypeInt64Array is used as is by vtkCellArray, other types are copied
+            cells.SetData(_vtk_array(offsets, np.int64, keep, vtk.VTK_TYPE_INT64),
+                          _vtk_array(connectivity, np.int64, keep, vtk.VTK_TYPE_INT64))
+            return cells
+
+        if self._polydata:
+            grid = vtk.vtkPolyData()
+            verts, lines = self._polyArrays()
+            grid.SetVerts(cellArray(*verts))
+            grid.SetLines(cellArray(*lines))
+            writer = vtk.vtkXMLPolyDataWriter()
+        else:
+            grid = vtk.vtkUnstructuredGrid()
+            types, offsets, connectivity = self._cellArrays()
+            grid.SetCells(_vtk_array(types, np.uint8, keep), cellArray(offsets, connectivity))
+            writer = vtk.vtkXMLUnstructuredGridWriter()
+        # vtkPoints stores float32 by default, keep that so output is unchanged
+        points = vtk.vtkPoints()
+        points.SetData(_vtk_array(self._points, np.float32, keep))
+        grid.SetPoints(points)
+        _vtk_attributes(grid.GetPointData(), self._pointData, keep)
+        _vtk_attributes(grid.GetCellData(), self._cellData, keep)
         writer.SetFileName(filename)
-        writer.SetInputData(self._grid)
+        self._encoding.configure(writer)
+        writer.SetInputData(grid)
         writer.Write()
 
 
 class GSDWriter(VtuWriter):
-    def __init__(self, filename, points, values):
+    _value_column = -3  # fix arbitrary data
+
+
+class AppendVtuWriter(object):
+    '''
+    Writes the .vtu of VtuWriter from chunks of points and values, in constant memory:
+        with AppendVtuWriter('cell') as writer:
+            for points, values in reader.iter_chunks():
+                writer.append(points, values)
+    Always uses the numpy backend. Raw uncompressed encoding avoids a temporary copy of the points.
+    '''
+    _value_column = -1
+
+    def __init__(self, filename, encoding=None, value_names=None):
         '''
         Appends .vtu to filename
+        :param encoding: Encoding of the arrays in the file, appended data only
+        :param value_names: names of the columns of values (reader.value_columns),
+            if given each column is also written as a point array of that name
         '''
-        self._points= vtk.vtkPoints()
-        self._grid = vtk.vtkUnstructuredGrid()
-        self._values = vtk.vtkDoubleArray()
-        self._values.SetName('point_values_array')
-        self._grid.SetPoints(self._points)
-        self._grid.GetPointData().SetScalars(self._values)
-        self._loadPoints(points, values)
-        self._write("{}.vtu".format(filename))
+        self._names = list(value_names or [])
+        point_data = [('point_values_array', np.float64, 1)] + \
+            [(name, np.float64, 1) for name in self._names]
+        self._stream = PointStream("{}.vtu".format(filename), point_data, encoding)
 
-    def _loadPoints(self, points, values):
-        poly = vtk.vtkPolyVertex()
-        poly.GetPointIds().SetNumberOfIds(points.shape[0])
-        for i, (point, value) in enumerate(zip(points, values)):
-            poly.GetPointIds().SetId(i, self._points.InsertNextPoint(point))
-            self._values.InsertNextValue(values[i][-3]) # fix arbitrary data
-        self._grid.InsertNextCell(poly.GetCellType(), poly.GetPointIds())
+    def open(self):
+        self._stream.open()
+        return self
+
+    def append(self, points, values):
+        '''
+        :param points: n x 3 array
+        :param values: n x k array, as for VtuWriter
+        '''
+        if self._names and len(self._names) != values.shape[1]:
+            raise ValueError('{} value names for {} value columns'.format(len(self._names),
+                                                                          values.shape[1]))
+        columns = [values[:, i] for i in range(len(self._names))]
+        self._stream.append(points, [values[:, self._value_column]] + columns)
+
+    def close(self):
+        '''
+        Complete the file, the writer can be opened again to overwrite it
+        '''
+        self._stream.close()
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def _write_piece(writer, filename, points, values, encoding, backend, point_data):
+    writer(filename, from_shared(points), None if values is None else from_shared(values),
+           encoding=encoding, backend=backend,
+           point_data=[(name, from_shared(handle)) for name, handle in point_data])
+
+
+class PVtuWriter(object):
+    def __init__(self, filename, points, values, partitions=None, split='index', max_workers=None,
+                 encoding=None, writer=VtuWriter, backend=None, point_data=None):
+        '''
+        Writes points, values as partitions filename_<i>.vtu, concurrently in a process pool,
+        and filename.pvtu that refers to them, so ParaView can load the pieces in parallel.
+        :param partitions: Number of pieces, defaults to the number of workers
+        :param split: 'index' cuts the rows in consecutive blocks,
+            'spatial' in slabs along the longest axis
+        :param max_workers: Number of processes, defaults to the number of cores
+        :param encoding: Encoding of the pieces, see VtuWriter
+        :param writer: writer class of the pieces, VtuWriter or GSDWriter
+        :param backend: 'vtk' or 'numpy', see VtuWriter
+        :param point_data: list of (name, array) added to the pieces, see VtuWriter
+        '''
+        if split not in ('index', 'spatial'):
+            raise ValueError('Split should be index or spatial, not {}'.format(split))
+        if backend == 'hdf':
+            raise ValueError('PVtuWriter writes .vtu pieces, use the vtk or numpy backend')
+        self._filename = filename
+        self._encoding = encoding or Encoding()
+        self._writer = writer
+        self._backend = backend
+        self._max_workers = max_workers
+        self._pointData = [(name, np.asarray(array)) for name, array in point_data or []]
+        partitions = partitions or max_workers or os.cpu_count() or 1
+        self._pieces = self._partition(points, split, max(1, min(partitions, points.shape[0])))
+        self._writePieces(points, values)
+        self._writeMaster(values)
+
+    @staticmethod
+    def _partition(points, split, n):
+        '''
+        :return: list of n slices or index arrays into points
+        '''
+        if split == 'index':
+            bounds = np.linspace(0, points.shape[0], n + 1).astype(np.int64)
+            return [slice(int(lo), int(hi)) for lo, hi in zip(bounds[:-1], bounds[1:])]
+        axis = int(np.argmax(np.ptp(points, axis=0))) if points.shape[0] else 0
+        order = np.argsort(points[:, axis], kind='stable')
+        return np.array_split(order, n)
+
+    def _pieceName(self, index):
+        return "{}_{}".format(self._filename, index)
+
+    def _writePieces(self, points, values):
+        with process_pool(self._max_workers) as pool:
+            futures = [pool.submit(_write_piece, self._writer, self._pieceName(index),
+                                   to_shared(points[rows]),
+                                   None if values is None else to_shared(values[rows]),
+                                   self._encoding, self._backend,
+                                   [(name, to_shared(array[rows]))
+                                    for name, array in self._pointData])
+                       for index, rows in enumerate(self._pieces)]
+            for future in futures:
+                future.result()
+
+    def _writeMaster(self, values):
+        byte_order = 'LittleEndian' if sys.byteorder == 'little' else 'BigEndian'
+        arrays = [DataArray(name, array, data_type(array)) for name, array in self._pointData]
+        if values is not None:
+            column = values[:, self._writer._value_column]
+            arrays.insert(0, DataArray('point_values_array', column, data_type(column)))
+        scalars = ' Scalars="{}"'.format(arrays[0].name) if arrays else ''
+        point_data = ''.join('      <PDataArray {}/>\n'.format(array.attributes())
+                             for array in arrays)
+        pieces = '\n'.join('    <Piece Source="{}.vtu"/>'.format(
+            os.path.basename(self._pieceName(index))) for index in range(len(self._pieces)))
+        with open("{}.pvtu".format(self._filename), 'w') as f:
+            f.write('<?xml version="1.0"?>\n'
+                    '<VTKFile type="PUnstructuredGrid" version="1.0" byte_order="{}" '
+                    'header_type="UInt32">\n'
+                    '  <PUnstructuredGrid GhostLevel="0">\n'
+                    '    <PPointData{}>\n'
+                    '{}'
+                    '    </PPointData>\n'
+                    '    <PPoints>\n'
+                    '      <PDataArray type="Float32" NumberOfComponents="3"/>\n'
+                    '    </PPoints>\n'
+                    '{}\n'
+                    '  </PUnstructuredGrid>\n'
+                    '</VTKFile>\n'.format(byte_order, scalars, point_data, pieces))
 
 
 class KChannelVtuWriter(VtuWriter):
-    def __init__(self, filename, points, values, channels):
+    def __init__(self, filename, points, values, channels, encoding=None, backend=None,
+                 polydata=False):
+        '''
+        Writes k point sets as one poly vertex cell each,
+        the value of a point is the index of its set.
+        '''
+        self._setup(encoding, backend, polydata)
         self._channels = channels
-        self._points = vtk.vtkPoints()
-        self._grid = vtk.vtkUnstructuredGrid()
-        self._values = vtk.vtkDoubleArray()
-        self._values.SetName('point_values_array')
-        self._grid.SetPoints(self._points)
-        self._grid.GetPointData().SetScalars(self._values)
         self._loadPoints(points, values)
-        self._write("{}.vtu".format(filename))
+        self._write(filename)
 
     def _loadPoints(self, pointset, valueset): # values is set
-        for index, (points, _, values) in enumerate(zip(pointset, self._channels, valueset)):
-            poly = vtk.vtkPolyVertex()
-            poly.GetPointIds().SetNumberOfIds(points.shape[0])
-            for i, (point, value) in enumerate(zip(points, values)):
-                poly.GetPointIds().SetId(i, self._points.InsertNextPoint(point))
-                self._values.InsertNextValue(index)
-            self._grid.InsertNextCell(poly.GetCellType(), poly.GetPointIds())
+        pointset = [points for points, _, _ in zip(pointset, self._channels, valueset)]
+        counts = [points.shape[0] for points in pointset]
+        self._setPoints(np.concatenate(pointset) if pointset else np.empty((0, 3)))
+        self._addPointData('point_values_array',
+                           np.repeat(np.arange(len(counts), dtype=np.float64), counts))
+        self._addCells(*channel_cells(counts))
 
 
-class NNWriter(VtuWriter):
-    def __init__(self, filename, points, values, channels, edges):
+class NNWriter(KChannelVtuWriter):
+    def __init__(self, filename, points, values, channels, edges, encoding=None, backend=None,
+                 polydata=False):
         '''
         Writes a k-way 1-nearest neighbour graph between points using edges.
+        With polydata the edges are written as lines.
+        :param edges: dict of (source offset, target offset) -> E x 2 array (or list of pairs) of
+            (source index, target index), indices within the point sets starting at these offsets
+            (see channel_offsets). Or an E x 2 array of indices into all points.
         '''
+        self._setup(encoding, backend, polydata)
         self._channels = channels
-        self._points = vtk.vtkPoints()
-        self._grid = vtk.vtkUnstructuredGrid()
-        self._values = vtk.vtkDoubleArray()
-        self._edges = edges # Dict-> {offset_src, offset_trg} -> [(src_index, trg_index)]
-        self._values.SetName('point_values_array')
-        self._grid.SetPoints(self._points)
-        self._grid.GetPointData().SetScalars(self._values)
+        self._edges = edges
         self._loadPoints(points, values)
-        self._write("{}.vtu".format(filename))
+        self._write(filename)
 
     def _loadPoints(self, pointset, valueset): # values is set
         # Points
-        for index, (points, _, values) in enumerate(zip(pointset, self._channels, valueset)):
-            poly = vtk.vtkPolyVertex()
-            poly.GetPointIds().SetNumberOfIds(points.shape[0])
-            for i, (point, value) in enumerate(zip(points, values)):
-                poly.GetPointIds().SetId(i, self._points.InsertNextPoint(point))
-                self._values.InsertNextValue(index)
-            self._grid.InsertNextCell(poly.GetCellType(), poly.GetPointIds())
-        # Edges
-        for offset, edges in self._edges.items():
-            sourceoffset, targetoffset = offset
-            for source, target in edges:
-                self._grid.InsertNextCell(vtk.VTK_LINE, 2, [sourceoffset+source, targetoffset+target])
-
-
-class GraphWriter(VtuWriter):
-    def __init__(self, filename, midpoints, values, tetras):
+        super()._loadPoints(pointset, valueset)
+        # Edges, all in one block of lines
+        if isinstance(self._edges, dict):
+            lines = [np.asarray(edges, dtype=np.int64).reshape(-1, 2) + np.array(offsets,
+                                                                                 dtype=np.int64)
+                     for offsets, edges in self._edges.items()]
+            lines = np.concatenate(lines) if lines else np.empty((0, 2), dtype=np.int64)
+        else:
+            lines = np.asarray(self._edges, dtype=np.int64).reshape(-1, 2)
+        if len(lines):
+            self._addCells(*uniform_cells(VTK_LINE, lines))
+
+
+class TetraMeshWriter(VtuWriter):
+    '''
+    Writes a tetrahedral mesh: points with point data,
+    and an M x 4 array of point indices as tetrahedra, added to the file as one block of cells.
+    '''
+    _poly_vertex = False
+
+    def __init__(self, filename, points, tetras, values=None, cell_data=None, drop_unused=False,
+                 encoding=None, backend=None, point_data=None):
         '''
-        Writes a k-way 1-nearest neighbour graph between points using edges.
+        :param points: N x 3 array
+        :param tetras: M x 4 integer array of indices into points
+        :param values: N values, written as point_values_array
+        :param cell_data: list of (name, array of M values), one per tetrahedron,
+            e.g. the circumradius
+        :param drop_unused: If true, points that are not a vertex of any tetrahedron are left out
+        :param point_data: list of (name, array of N values), see VtuWriter
         '''
-        # self._channels=channels
-        self._points= vtk.vtkPoints()
-        self._grid = vtk.vtkUnstructuredGrid()
-        self._values = vtk.vtkDoubleArray()
-        # self._edges = edges # Dict-> {offset_src, offset_trg} -> [(src_index, trg_index)]
-        self._values.SetName('point_values_array')
-        self._grid.SetPoints(self._points)
-        self._grid.GetPointData().SetScalars(self._values)
-        self._loadPoints(midpoints, values, tetras)
-        self._write("{}.vtu".format(filename))
-
-    def _loadPoints(self, points, values, tetras):
-        # Points
-        poly = vtk.vtkPolyVertex()
-        poly.GetPointIds().SetNumberOfIds(points.shape[0])
-        for i, (point, value) in enumerate(zip(points, values)):
-            poly.GetPointIds().SetId(i, self._points.InsertNextPoint(point))
-            self._values.InsertNextValue(value)
-        self._grid.InsertNextCell(poly.GetCellType(), poly.GetPointIds())
-        # Tetras
-        # print('Adding {} tetras'.format(len(tetras)))
-        for tetra in tetras:
-            self._grid.InsertNextCell(vtk.VTK_TETRA, 4, tetra)
+        self._setup(encoding, backend)
+        self._loadMesh(points, tetras, values, cell_data or [], drop_unused, point_data or [])
+        self._write(filename)
+
+    def _loadMesh(self, points, tetras, values, cell_data, drop_unused, point_data):
+        tetras = np.asarray(tetras, dtype=np.int64).reshape(-1, 4)
+        if drop_unused:
+            used, tetras = np.unique(tetras, return_inverse=True)
+            tetras = tetras.reshape(-1, 4)
+            points = points[used]
+            values = None if values is None else np.asarray(values)[used]
+            point_data = [(name, np.asarray(array)[used]) for name, array in point_data]
+        self._setPoints(points)
+        if values is not None:
+            self._addPointData('point_values_array', values)
+        for name, array in point_data:
+            self._addPointData(name, array)
+        if self._poly_vertex:
+            self._addCells(*poly_vertex_cells(points.shape[0]))
+        self._addCells(*uniform_cells(VTK_TETRA, tetras))
+        for name, array in cell_data:
+            array = np.asarray(array)
+            if len(array) != len(tetras):
+                raise ValueError('Cell data {} has {} values for {} tetrahedra'.format(
+                    name, len(array), len(tetras)))
+            if self._poly_vertex:
+                # The poly vertex cell comes first and has no value
+                blank = np.full(1, np.nan if array.dtype.kind == 'f' else 0, dtype=array.dtype)
+                array = np.concatenate([blank, array])
+            self._addCellData(name, array)
+
 
+class GraphWriter(TetraMeshWriter):
+    '''
+    A TetraMeshWriter that also writes all points as one poly vertex cell,
+    so they are visible without the mesh.
+    '''
+    _poly_vertex = True
 
-class AlphaGraphWriter(VtuWriter):
-    def __init__(self, filename, midpoints, values, tetras):
+    def __init__(self, filename, midpoints, values, tetras, encoding=None, backend=None,
+                 cell_data=None, drop_unused=False):
         '''
-        Writes a k-way 1-nearest neighbour graph between points using edges.
+        Writes points with a 1D array of values as a poly vertex,
+        and tetras (M x 4 point indices) as tetrahedra.
+        :param cell_data: list of (name, array of M values), see TetraMeshWriter
+        :param drop_unused: If true, points that are not a vertex of any tetrahedron are left out
         '''
-        # self._channels=channels
-        self._points= vtk.vtkPoints()
-        self._grid = vtk.vtkUnstructuredGrid()
-        self._values = vtk.vtkDoubleArray()
-        # self._edges = edges # Dict-> {offset_src, offset_trg} -> [(src_index, trg_index)]
-        self._values.SetName('point_values_array')
-        self._grid.SetPoints(self._points)
-        self._grid.GetPointData().SetScalars(self._values)
-        self._loadPoints(midpoints, values, tetras)
-        self._write("{}.vtu".format(filename))
-
-    def _loadPoints(self, points, values, tetras):
-        # Points
-        poly = vtk.vtkPolyVertex()
-        poly.GetPointIds().SetNumberOfIds(points.shape[0])
-        for i, (point, value) in enumerate(zip(points, values)):
-            poly.GetPointIds().SetId(i, self._points.InsertNextPoint(point))
-            self._values.InsertNextValue(value)
-        self._grid.InsertNextCell(poly.GetCellType(), poly.GetPointIds())
-        # Tetras
-        # print('Adding {} tetras'.format(len(tetras)))
-        for tetra in tetras:
-            self._grid.InsertNextCell(vtk.VTK_TETRA, 4, tetra)
+        super().__init__(filename, midpoints, tetras, values, cell_data, drop_unused, encoding,
+                         backend)
+
+
+class AlphaGraphWriter(GraphWriter):
+    pass
 
 
 class MatWriter(VtuWriter):
-    def __init__(self, filename, mat, flip = True):
+    def __init__(self, filename, mat, flip=True, encoding=None, backend=None, polydata=False):
         '''
-        Write a square matrix to VTK.
-        Flip results in [0,0] to [n,n] being mapped as top left, lower right.
+        Write a matrix to VTK.
+        Flip results in [0,0] to [n,n] being mapped as top left, lower right:
+        entry [i, j] is at (n - i, j, 0) for n rows, else at (i, j, 0).
+        A scipy.sparse matrix is written as a point cloud of its nonzero entries
+        (.vtu, .vtp with polydata).
+        Anything else is a dense array, written as an image
+        (.vti, or a VTKHDF ImageData for the hdf backend) on the values of mat without a copy.
         '''
         assert(mat is not None)
-        self._points = vtk.vtkPoints()
-        self._grid = vtk.vtkUnstructuredGrid()
-        self._values = vtk.vtkDoubleArray()
-        self._values.SetName('point_values_array')
-        self._grid.SetPoints(self._points)
-        self._grid.GetPointData().SetScalars(self._values)
-        self._loadPoints(mat)
-        self._write("{}.vtu".format(filename))
-
-    def _loadPoints(self, mat):
-        n = mat.shape[0]
-        nsq = n**2
-        points = np.empty((nsq, 3))
-        values = np.empty((nsq, 1))
-        for k in range(nsq):
-            i, j = divmod(k, n)
-            points[k] = [n-i,j,0]
-            values[k] = mat[i,j] if (i,j) in mat else 0
-
-        poly = vtk.vtkPolyVertex()
-        poly.GetPointIds().SetNumberOfIds(points.shape[0])
-        for i, (point, value) in enumerate(zip(points, values)):
-            poly.GetPointIds().SetId(i, self._points.InsertNextPoint(point))
-            self._values.InsertNextValue(value)
-        self._grid.InsertNextCell(poly.GetCellType(), poly.GetPointIds())
+        self._setup(encoding, backend, polydata)
+        self._image = None
+        if sparse.issparse(mat):
+            self._loadPoints(mat, flip)
+        else:
+            self._loadImage(np.asarray(mat), flip)
+        self._write(filename)
+
+    def _loadPoints(self, mat, flip):
+        entries = mat.tocoo(copy=True)
+        entries.sum_duplicates()
+        entries.eliminate_zeros()
+        points = np.zeros((entries.nnz, 3))
+        points[:, 0] = mat.shape[0] - entries.row if flip else entries.row
+        points[:, 1] = entries.col
+        self._setPoints(points)
+        self._addPointData('point_values_array', entries.data)
+        self._addCells(*poly_vertex_cells(entries.nnz))
+
+    def _loadImage(self, mat, flip):
+        if mat.ndim != 2:
+            raise ValueError('Expected a 2D matrix, not shape {}'.format(mat.shape))
+        rows, cols = mat.shape
+        # Image x runs along the columns of mat, so its values are mat in C order,
+        # the direction puts i along x
+        if flip:
+            origin, direction = (rows, 0, 0), (0, -1, 0, 1, 0, 0, 0, 0, 1)
+        else:
+            origin, direction = (0, 0, 0), (0, 1, 0, 1, 0, 0, 0, 0, 1)
+        self._image = (cols, rows, 1), origin, direction
+        self._addPointData('point_values_array', mat.reshape(-1))
+
+    def _write(self, filename):
+        if self._image is None:
+            return super()._write(filename)
+        filename += IMAGE_EXTENSIONS[self._backend]
+        if self._backend == 'numpy':
+            write_image_data(filename, *self._image, self._pointData, encoding=self._encoding)
+        elif self._backend == 'hdf':
+            vtkhdf.write_image_data(filename, *self._image, self._pointData,
+                                    encoding=self._encoding)
+        else:
+            self._writeVtkImage(filename)
+
+    def _writeVtkImage(self, filename):
+        import vtk
+        shape, origin, direction = self._image
+        image = vtk.vtkImageData()
+        image.SetDimensions(*shape)
+        image.SetOrigin(*origin)
+        image.SetDirectionMatrix(*direction)
+        keep = []
+        _vtk_attributes(image.GetPointData(), self._pointData, keep)
+        writer = vtk.vtkXMLImageDataWriter()
+        writer.SetFileName(filename)
+        self._encoding.configure(writer)
+        writer.SetInputData(image)
+        writer.Write()
 
 
 class MidPointWriter(VtuWriter):
-    def __init__(self, filename, midpoints):
+    def __init__(self, filename, midpoints, encoding=None, backend=None, polydata=False):
         '''
-        Writes a point cloud of k midpoints
+        Writes a point cloud of k midpoints, one poly vertex cell per entry of midpoints,
+        with the distance as value.
+        :param midpoints: dict of (source offset, target offset) ->
+            (E x 3 array of midpoints, E x k array of values), as returned by
+            midpoints.channel_midpoints, or -> list of (midpoint, values) tuples.
+            The last of the values is the distance.
         '''
+        self._setup(encoding, backend, polydata)
         self._k = len(midpoints)
-        self._points = vtk.vtkPoints()
-        self._grid = vtk.vtkUnstructuredGrid()
-        self._values = vtk.vtkDoubleArray()
         self._midpoints = midpoints
-        self._values.SetName('point_values_array')
-        self._grid.SetPoints(self._points)
-        self._grid.GetPointData().SetScalars(self._values)
         self._loadPoints()
-        self._write("{}.vtu".format(filename))
+        self._write(filename)
 
     def _loadPoints(self):
-        for (src_offset, trg_offset),midpoints in self._midpoints.items():
-            p, v = zip(*midpoints)
-            points = np.empty((len(p), len(p[0])))
-            for index, coord in enumerate(p):
-                points[index, :] = coord
-            values = np.empty((len(v), len(v[0])))
-            for index, value in enumerate(v):
-                values[index, :] = value
-            poly = vtk.vtkPolyVertex()
-            poly.GetPointIds().SetNumberOfIds(points.shape[0])
-            for i, (point, value) in enumerate(zip(points, values)):
-                poly.GetPointIds().SetId(i, self._points.InsertNextPoint(point))
-                self._values.InsertNextValue(value[-1]) # Use distance as value
-            self._grid.InsertNextCell(poly.GetCellType(), poly.GetPointIds())
+        pointset, valueset = [], []
+        for midpoints in self._midpoints.values():
+            if isinstance(midpoints, tuple) and len(midpoints) == 2 and \
+                    isinstance(midpoints[0], np.ndarray):
+                points, values = midpoints
+            else:
+                points = np.array([p for p, _ in midpoints], dtype=np.float64).reshape(-1, 3)
+                values = np.array([v for _, v in midpoints], dtype=np.float64)
+                values = values.reshape(len(points), -1)
+            pointset.append(points)
+            valueset.append(values[:, -1] if values.ndim == 2 else values)  # Use distance as value
+        self._setPoints(np.concatenate(pointset) if pointset else np.empty((0, 3)))
+        self._addPointData('point_values_array',
+                           np.concatenate(valueset) if valueset else np.empty(0))
+        self._addCells(*channel_cells([len(points) for points in pointset]))
+
+
+def benchmark_encodings(points, values, encodings=None, writer=VtuWriter, directory=None,
+                        backend=None):
+    '''
+    Write points, values once with each encoding and report write speed and file size.
+    :param encodings: list of Encoding, defaults to encoding.default_settings()
+        (default_hdf_settings() for hdf)
+    :param writer: writer class taking (filename, points, values, encoding=, backend=)
+    :param directory: where to write the test files,
+        defaults to a temporary directory that is removed afterwards
+    :param backend: 'vtk', 'numpy' or 'hdf' (with a list of HDFEncoding), see VtuWriter
+    :return: list of (encoding, seconds, MB/s, file size in bytes).
+        MB/s is measured on the array data written, float32 points plus float64 values.
+        Encodings the backend can't write (e.g. lz4 without the lz4 package) are skipped.
+    '''
+    encodings = encodings or (default_hdf_settings() if backend == 'hdf' else default_settings())
+    megabytes = points.shape[0] * (3 * 4 + 8) / 1e6
+    results = []
+    with tempfile.TemporaryDirectory(dir=directory) as outdir:
+        for index, encoding in enumerate(encodings):
+            name = os.path.join(outdir, 'benchmark{}'.format(index))
+            start = time.perf_counter()
+            try:
+                writer(name, points, values, encoding=encoding, backend=backend)
+            except (ImportError, ValueError) as e:
+                logger.warning('Skipping {} : {}'.format(encoding, e))
+                continue
+            seconds = time.perf_counter() - start
+            size = os.path.getsize(name + EXTENSIONS[backend or DEFAULT_BACKEND])
+            results.append((encoding, seconds, megabytes / seconds, size))
+            logger.info('{} : {:.3f} s {:.1f} MB/s {:.1f} MB'.format(encoding, seconds,
+                                                                    megabytes / seconds,
+                                                                    size / 1e6))
+    return results
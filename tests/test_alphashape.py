@@ -0,0 +1,32 @@
+import smlmvis.alphashape as a
+import smlmvis.vtuwriter as v
+import numpy as np
+import os
+import tempfile
+
+
+def as_set(tetras):
+    return set(map(tuple, np.sort(tetras, axis=1)))
+
+
+def test_circumspheres():
+    points = np.array([[0, 0, 0], [2, 0, 0], [0, 2, 0], [0, 0, 2], [1, 1, 0]], dtype=np.float64)
+    centers, radii = a.circumspheres(points, [[0, 1, 2, 3], [0, 1, 2, 4]])
+    assert np.allclose(centers[0], [1, 1, 1])
+    assert np.isclose(radii[0], np.sqrt(3))
+    assert radii[1] == np.inf
+
+
+def test_alpha_complex_tiles():
+    points = np.random.default_rng(0).random((3000, 3)) * 50
+    tetras, radii = a.alpha_complex(points, 4)
+    assert len(tetras) and np.all(radii <= 4)
+    centers, check = a.circumspheres(points, tetras)
+    assert np.allclose(radii, check)
+    assert np.allclose(np.linalg.norm(points[tetras] - centers[:, None], axis=2), radii[:, None])
+    tiled, tiled_radii = a.alpha_complex(points, 4, tile_size=15)
+    assert len(tiled) == len(tetras)
+    assert as_set(tiled) == as_set(tetras)
+    with tempfile.TemporaryDirectory() as indir:
+        v.AlphaGraphWriter(os.path.join(indir, 'alpha'), points, points[:, 0], tiled, backend='numpy',
+                           cell_data=[('circumradius', tiled_radii)], drop_unused=True)
@@ -0,0 +1,62 @@
+import smlmvis.gsdreader as g
+import smlmvis.thunderstormreader as t
+from smlmvis.cache import DecodeCache
+from tests.test_gsdreader import write_gsd, make_rows, HEADER
+from tests.test_readers import write_thunderstorm
+import numpy as np
+import os
+import tempfile
+
+
+def test_cache_hit():
+    with tempfile.TemporaryDirectory() as indir:
+        cache = DecodeCache(os.path.join(indir, 'cache'))
+        fname = write_gsd(indir, make_rows(40))
+        first = g.GSDReader(fname, cache=cache)
+        second = g.GSDReader(fname, cache=cache)
+        assert (isinstance(second.points, np.memmap))
+        assert (np.array_equal(first.points, second.points))
+        assert (np.array_equal(first.values, second.values))
+        assert (first.invalid_data_pct == second.invalid_data_pct)
+        raw = g.GSDReader(fname, preprocess=False, cache=cache)
+        assert (len(raw.points) == 40)
+        assert (len(cache.entries()) == 2)
+        del first, second, raw
+
+
+def test_cache_desc_change():
+    with tempfile.TemporaryDirectory() as indir:
+        cache = DecodeCache(os.path.join(indir, 'cache'))
+        fname = write_gsd(indir, make_rows(40))
+        first = g.GSDReader(fname, cache=cache)
+        with open(fname + '.desc', 'w') as f:
+            f.write(HEADER.replace('Frame(UINT32)', 'Frame(float)'))
+        second = g.GSDReader(fname, cache=cache)
+        expected = g.GSDReader(fname)
+        assert (len(cache.entries()) == 2)
+        assert (np.array_equal(second.values, expected.values))
+        assert (not np.array_equal(second.values[:, 1], first.values[:, 1]))
+        del first, second
+
+
+def test_cache_eviction():
+    with tempfile.TemporaryDirectory() as indir:
+        fname, _ = write_thunderstorm(indir)
+        cache = DecodeCache(os.path.join(indir, 'cache'))
+        t.ThunderstormReader(fname, cache=cache)
+        size = cache.entries()[0][1]
+        small = DecodeCache(os.path.join(indir, 'cache'), max_bytes=size + 1)
+        gname = write_gsd(indir, make_rows(40))
+        g.GSDReader(gname, cache=small)
+        entries = small.entries()
+        assert (len(entries) == 1)
+        assert (os.path.isfile(os.path.join(entries[0][2], 'pct.npy')))
+
+
+def test_cache_engine():
+    with tempfile.TemporaryDirectory() as indir:
+        fname, _ = write_thunderstorm(indir)
+        cache = DecodeCache(os.path.join(indir, 'cache'))
+        t.ThunderstormReader(fname, cache=cache)
+        t.ThunderstormReader(fname, cache=cache, engine='pyarrow')
+        assert (len(cache.entries()) == 2)
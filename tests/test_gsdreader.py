@@ -0,0 +1,221 @@
+import smlmvis.gsdreader as g
+import smlmvis.vtuwriter as v
+import numpy as np
+import vtk
+from vtk.util.numpy_support import vtk_to_numpy
+import pytest
+import os
+import struct
+import tempfile
+
+HEADER = 'Stack ID(UINT32),Frame(UINT32),Event ID(UINT32),X(float),Y(float),Z(float),Photons(float),Sigma X(float),Sigma Y(float)\n'
+
+
+def write_gsd(directory, rows, trailing=b''):
+    fname = os.path.join(directory, 'test.bin')
+    with open(fname + '.desc', 'w') as f:
+        f.write(HEADER)
+    with open(fname, 'wb') as f:
+        for row in rows:
+            f.write(struct.pack('IIIffffff', *row))
+        f.write(trailing)
+    return fname
+
+
+def make_rows(n, seed=0):
+    rng = np.random.RandomState(seed)
+    rows = []
+    for i in range(n):
+        z = 1e36 if i % 7 == 0 else rng.uniform(-500, 500)
+        rows.append((1, i // 3 + 1, i, rng.uniform(0, 40000), rng.uniform(0, 40000), z,
+                     rng.uniform(100, 5000), rng.uniform(5, 20), rng.uniform(5, 20)))
+    return rows
+
+
+def test_binary_decode():
+    rows = make_rows(100)
+    with tempfile.TemporaryDirectory() as indir:
+        r = g.GSDReader(write_gsd(indir, rows), preprocess=False)
+    expected = np.array([struct.unpack('IIIffffff', struct.pack('IIIffffff', *row)) for row in rows])
+    assert (np.array_equal(r.points, expected[:, 3:6]))
+    assert (np.array_equal(r.values, np.hstack([expected[:, :3], expected[:, 6:]])))
+    assert (r.value_names[1] == 'Frame')
+
+
+def test_binary_truncated():
+    rows = make_rows(10)
+    with tempfile.TemporaryDirectory() as indir:
+        r = g.GSDReader(write_gsd(indir, rows, trailing=b'\x00' * 17))
+    assert (r.points.shape == (8, 3))
+    assert (r.values.shape == (8, 6))
+
+
+def test_binary_mmap():
+    rows = make_rows(50)
+    with tempfile.TemporaryDirectory() as indir:
+        fname = write_gsd(indir, rows)
+        r = g.GSDReader(fname)
+        m = g.GSDReader(fname, mmap=True)
+        assert (np.array_equal(m.points, r.points))
+        assert (np.array_equal(m.values, r.values))
+        assert (m.invalid_data_pct == r.invalid_data_pct)
+        assert (np.array_equal(m.column('Frame'), r.column('Frame')))
+        u = g.GSDReader(fname, preprocess=False, mmap=True)
+        assert (not u.points.flags.owndata)
+        assert (u.points.shape == (50, 3))
+        del r, m, u
+
+
+def test_binary_chunks():
+    rows = make_rows(100)
+    with tempfile.TemporaryDirectory() as indir:
+        fname = write_gsd(indir, rows, trailing=b'\x00' * 5)
+        r = g.GSDReader(fname)
+        chunks = list(g.GSDReader(fname, lazy=True).iter_chunks(16))
+    assert (max(len(p) for p, _ in chunks) <= 16)
+    assert (np.array_equal(np.vstack([p for p, _ in chunks]), r.points))
+    assert (np.array_equal(np.vstack([v for _, v in chunks]), r.values))
+    assert (len(list(r.points_generator())) == len(r.points))
+
+
+def test_ascii_chunks():
+    rows = make_rows(30)
+    with tempfile.TemporaryDirectory() as indir:
+        fname = os.path.join(indir, 'test.ascii')
+        with open(fname, 'w') as f:
+            f.write('#' + HEADER)
+            for row in rows:
+                f.write(','.join('{}'.format(c) for c in row) + '\n')
+        r = g.GSDReader(fname, binary=False)
+        chunks = list(g.GSDReader(fname, binary=False, lazy=True).iter_chunks(7))
+    assert (r.points.shape == (len(rows) - 5, 3))
+    assert (np.array_equal(np.vstack([p for p, _ in chunks]), r.points))
+    assert (np.array_equal(np.vstack([v for _, v in chunks]), r.values))
+
+
+
+def write_ascii(fname, rows, header=True, blank=False, newline=True):
+    lines = [','.join('{}'.format(c) for c in row) for row in rows]
+    if blank:
+        lines = [line + '\n' if i % 4 == 0 else line for i, line in enumerate(lines)]
+    with open(fname, 'w') as f:
+        if header:
+            f.write('#' + HEADER)
+        f.write('\n'.join(lines) + ('\n' if newline else ''))
+
+
+def test_ascii_blocks():
+    rows = make_rows(50)
+    expected = np.array(rows, dtype=np.float64)
+    with tempfile.TemporaryDirectory() as indir:
+        fname = os.path.join(indir, 'test.ascii')
+        layouts = [(True, False, True), (False, True, False), (True, True, False)]
+        for header, blank, newline in layouts:
+            write_ascii(fname, rows, header, blank, newline)
+            start = len(HEADER) + 1 if header else 0
+            blocks = g._ascii_blocks(fname, start, 300)
+            assert (len(blocks) > 5)
+            assert (blocks[0][0] == start)
+            assert (sum(length for _, length in blocks) == os.path.getsize(fname) - start)
+            points, values = g.read_gsd_ascii(fname, blocksize=300, max_workers=4)
+            single = g.read_gsd_ascii(fname)
+            assert (np.array_equal(points, single[0]) and np.array_equal(values, single[1]))
+            assert (np.allclose(points, expected[:, 3:6]))
+            assert (np.allclose(values, np.hstack([expected[:, :3], expected[:, 6:]])))
+        # Cuts in lines longer than the blocks
+        assert (np.array_equal(g.read_gsd_ascii(fname, blocksize=7)[0], single[0]))
+
+
+def test_empty_files():
+    with tempfile.TemporaryDirectory() as indir:
+        fname = os.path.join(indir, 'test.ascii')
+        for content in ['', '#' + HEADER]:
+            with open(fname, 'w') as f:
+                f.write(content)
+            if content:
+                assert (g.GSDReader(fname, binary=False).points is None)
+            assert (g.read_gsd_ascii(fname)[0].shape == (0, 3))
+        short = write_gsd(indir, [], trailing=b'\x00' * 10)
+        assert (g.GSDReader(short).points is None)
+        assert (g.GSDReader(short, compact=True).points is None)
+
+
+def test_loadcell_parallel():
+    with tempfile.TemporaryDirectory() as indir:
+        tree = {'1': {}}
+        for di in ['d1', 'd2']:
+            tree['1'][di] = {}
+            for k, ab in enumerate(['ab1', 'ab2']):
+                path = os.path.join(indir, di, ab)
+                os.makedirs(path)
+                fname = write_gsd(path, make_rows(20 + k, seed=k))
+                tree['1'][di][ab] = {'test.bin': fname, 'test.bin.desc': fname + '.desc'}
+        serial = g.loadcell('1', tree)
+        parallel = g.loadcell_parallel('1', tree, max_workers=2)
+    for di in serial:
+        for ab in serial[di]:
+            for s, p in zip(serial[di][ab], parallel[di][ab]):
+                for sc, pc in zip(s, p):
+                    assert (np.array_equal(sc, pc))
+
+
+def test_loadexperiment_failed_file():
+    with tempfile.TemporaryDirectory() as indir:
+        tree = {'1': {'d1': {}}}
+        for ab in ['ab1', 'ab2', 'ab3']:
+            path = os.path.join(indir, ab)
+            os.makedirs(path)
+            fname = write_gsd(path, make_rows(20))
+            tree['1']['d1'][ab] = {'test.bin': fname, 'test.bin.desc': fname + '.desc'}
+        os.remove(tree['1']['d1']['ab2']['test.bin'])
+        with open(tree['1']['d1']['ab3']['test.bin.desc'], 'w') as f:
+            f.write('not a header')
+        data = g.loadexperiment_parallel(tree, max_workers=2)
+    assert (list(data['1']['d1']) == ['ab1'])
+    assert (len(data['1']['d1']['ab1'][0][0]) == 17)
+
+
+def test_binary_compact():
+    with tempfile.TemporaryDirectory() as indir:
+        fname = write_gsd(indir, make_rows(30))
+        r = g.GSDReader(fname)
+        c = g.GSDReader(fname, compact=True)
+    assert (c.column('Frame').dtype == np.uint32)
+    assert (c.column('Photons').dtype == np.float32)
+    assert (np.array_equal(c.values, r.values))
+    assert (np.array_equal(c.points, r.points))
+    assert (c.values is c.values)
+
+
+def test_frames_mmap():
+    with tempfile.TemporaryDirectory() as indir:
+        fname = write_gsd(indir, make_rows(60))
+        r = g.GSDReader(fname)
+        m = g.GSDReader(fname, mmap=True)
+        for s, e in zip(r.frames(4, 9), m.frames(4, 9)):
+            assert (np.array_equal(s, e))
+        del m
+    frames = r.values[:, 1]
+    assert (len(r.frames(4, 9)[0]) == np.count_nonzero((frames >= 4) & (frames < 9)))
+
+
+def test_append_value_columns():
+    with tempfile.TemporaryDirectory() as indir:
+        fname = write_gsd(indir, make_rows(40))
+        r = g.GSDReader(fname, lazy=True)
+        assert (r.value_columns == ['Stack ID', 'Frame', 'Event ID', 'Photons', 'Sigma X', 'Sigma Y'])
+        name = os.path.join(indir, 'append')
+        with v.AppendVtuWriter(name, value_names=r.value_columns) as writer:
+            for points, values in r.iter_chunks(16):
+                writer.append(points, values)
+        reader = vtk.vtkXMLUnstructuredGridReader()
+        reader.SetFileName(name + '.vtu')
+        reader.Update()
+        data = reader.GetOutput().GetPointData()
+        full = g.GSDReader(fname)
+        for i, column in enumerate(full.value_columns):
+            assert (np.array_equal(vtk_to_numpy(data.GetArray(column)), full.values[:, i]))
+        assert ([n for n, _ in full.point_data()] == full.value_columns)
+        with pytest.raises(ValueError):
+            with v.AppendVtuWriter(name, value_names=full.value_names) as writer:
+                writer.append(full.points, full.values)
@@ -0,0 +1,37 @@
+import smlmvis.midpoints as m
+import smlmvis.vtuwriter as v
+import numpy as np
+import os
+import filecmp
+import tempfile
+
+
+def test_nearest_neighbours():
+    rng = np.random.default_rng(0)
+    source, target = rng.random((200, 3)), rng.random((150, 3))
+    pairs, distances = m.nearest_neighbours(source, target)
+    brute = np.linalg.norm(source[:, None] - target[None], axis=2)
+    assert np.array_equal(pairs[:, 0], np.arange(200))
+    assert np.array_equal(pairs[:, 1], brute.argmin(axis=1))
+    assert np.allclose(distances, brute.min(axis=1))
+    pairs, distances = m.nearest_neighbours(source, target, max_distance=0.05)
+    assert np.array_equal(pairs[:, 0], np.flatnonzero(brute.min(axis=1) < 0.05))
+
+
+def test_channel_midpoints():
+    rng = np.random.default_rng(1)
+    pointset = [rng.random((100, 3)), np.empty((0, 3)), rng.random((80, 3))]
+    midpoints = m.channel_midpoints(pointset)
+    assert sorted(midpoints) == [(0, 100), (100, 0)]
+    centers, values = midpoints[(0, 100)]
+    pairs = values[:, :2].astype(np.int64)
+    assert np.allclose(centers, (pointset[0][pairs[:, 0]] + pointset[2][pairs[:, 1]]) / 2)
+    assert np.allclose(values[:, 2], np.linalg.norm(pointset[0][pairs[:, 0]] - pointset[2][pairs[:, 1]], axis=1))
+    edges = {key: pairs for key, (pairs, _) in m.channel_neighbours(pointset).items()}
+    assert np.array_equal(edges[(0, 100)], pairs)
+    listed = {key: list(zip(map(tuple, c), map(tuple, val))) for key, (c, val) in midpoints.items()}
+    with tempfile.TemporaryDirectory() as indir:
+        v.MidPointWriter(os.path.join(indir, 'arrays'), midpoints)
+        v.MidPointWriter(os.path.join(indir, 'lists'), listed)
+        assert filecmp.cmp(os.path.join(indir, 'arrays.vtu'), os.path.join(indir, 'lists.vtu'), shallow=False)
+        v.NNWriter(os.path.join(indir, 'nn'), pointset, [None] * 3, [0, 1, 2], edges)
@@ -0,0 +1,53 @@
+import smlmvis.gsdreader as g
+import smlmvis.query as q
+from tests.test_gsdreader import write_gsd, make_rows
+import numpy as np
+import tempfile
+
+
+def chained(points, values):
+    p, v, _ = g.mask_z(points, values, 1e15)
+    p, v = g.filter_z_plane(p, v, -200, 300)
+    p, v = g.slice_roi(p, v, (5000, 5000), (35000, 30000))
+    return g.filter_photoncount_outliers(p, v, k_sd=1)
+
+
+def test_query_fused():
+    with tempfile.TemporaryDirectory() as indir:
+        r = g.GSDReader(write_gsd(indir, make_rows(500)), preprocess=False)
+    query = r.query().valid_z().z(-200, 300).roi((5000, 5000), (35000, 30000)).photons(k_sd=1)
+    ep, ev = chained(r.points, r.values)
+    p, v = query.collect()
+    assert (len(p) > 0)
+    assert (np.array_equal(p, ep))
+    assert (np.array_equal(v, ev))
+    assert (np.array_equal(r.points[query.indices()], ep))
+    assert (query.value('Frame', 10, 20).count() <= len(p))
+
+
+def test_query_numpy_fallback():
+    with tempfile.TemporaryDirectory() as indir:
+        r = g.GSDReader(write_gsd(indir, make_rows(200)), preprocess=False)
+    ne, q.numexpr = q.numexpr, None
+    try:
+        p, v = r.query().valid_z().z(-200, 300).roi((5000, 5000), (35000, 30000)).photons(k_sd=1).collect()
+    finally:
+        q.numexpr = ne
+    ep, ev = chained(r.points, r.values)
+    assert (np.array_equal(p, ep))
+    assert (np.array_equal(v, ev))
+
+
+def test_query_compact():
+    with tempfile.TemporaryDirectory() as indir:
+        fname = write_gsd(indir, make_rows(300))
+        r = g.GSDReader(fname, preprocess=False)
+        c = g.GSDReader(fname, preprocess=False, compact=True)
+    query = c.query().valid_z().z(-200, 300).value('Frame', 10, 80).photons(k_sd=1)
+    p, v = query.collect()
+    ep, ev = r.query().valid_z().z(-200, 300).value('Frame', 10, 80).photons(k_sd=1).collect()
+    assert (len(p) > 0)
+    assert (np.array_equal(p, ep))
+    assert (np.array_equal(v, ev))
+    # Queries read the typed columns, values is never assembled
+    assert (c._values is None)
@@ -0,0 +1,107 @@
+import smlmvis.thunderstormreader as t
+import smlmvis.dlpreader as d
+import numpy as np
+import pandas as pd
+import os
+import tempfile
+
+
+def write_thunderstorm(directory, n=100, seed=0):
+    rng = np.random.RandomState(seed)
+    data = pd.DataFrame({'id': np.arange(1, n + 1), 'frame': np.repeat(np.arange(1, n // 4 + 2), 4)[:n],
+                         'x [nm]': rng.uniform(0, 1e4, n), 'y [nm]': rng.uniform(0, 1e4, n),
+                         'z [nm]': rng.uniform(-500, 500, n),
+                         'sigma1 [nm]': rng.uniform(50, 200, n), 'sigma2 [nm]': rng.uniform(50, 200, n),
+                         'intensity [photon]': rng.uniform(100, 5000, n), 'offset [photon]': rng.uniform(0, 50, n),
+                         'bkgstd [photon]': rng.uniform(0, 10, n), 'chi2': rng.uniform(0, 1, n),
+                         'uncertainty [nm]': rng.uniform(1, 20, n)})
+    fname = os.path.join(directory, 'thunderstorm.csv')
+    data.to_csv(fname, index=False)
+    return fname, data
+
+
+def test_thunderstorm_chunks():
+    with tempfile.TemporaryDirectory() as indir:
+        fname, data = write_thunderstorm(indir)
+        r = t.ThunderstormReader(fname)
+        chunks = list(t.ThunderstormReader(fname, lazy=True).iter_chunks(30))
+    assert (np.allclose(r.points, data[['x [nm]', 'y [nm]', 'z [nm]']].values))
+    assert ([len(p) for p, _ in chunks] == [30, 30, 30, 10])
+    assert (np.array_equal(np.vstack([p for p, _ in chunks]), r.points))
+    assert (np.array_equal(np.vstack([v for _, v in chunks]), r.values))
+
+
+def test_dlp_chunks():
+    A = np.random.RandomState(0).uniform(0, 100, (25, 8))
+    with tempfile.TemporaryDirectory() as indir:
+        fname = os.path.join(indir, 'test.3dlp')
+        np.savetxt(fname, A)
+        r = d.DlpReader(fname)
+        chunks = list(d.DlpReader(fname, lazy=True).iter_chunks(10))
+    assert ([len(p) for p, _ in chunks] == [10, 10, 5])
+    assert (np.array_equal(np.vstack([v for _, v in chunks]), r.values))
+    assert (len(list(r.values_generator())) == 25)
+
+
+def test_value_names_match_values():
+    with tempfile.TemporaryDirectory() as indir:
+        fname, data = write_thunderstorm(indir)
+        r = t.ThunderstormReader(fname)
+    assert (r.value_names[:2] == ['id', 'frame'])
+    for i, name in enumerate(r.value_names):
+        assert (np.allclose(r.values[:, i], data[name].values))
+
+
+def test_compact_columns():
+    with tempfile.TemporaryDirectory() as indir:
+        fname, data = write_thunderstorm(indir)
+        r = t.ThunderstormReader(fname)
+        c = t.ThunderstormReader(fname, compact=True)
+    assert (c.points.dtype == np.float32)
+    assert (c.column('frame').dtype == np.uint32)
+    assert (c.column('chi2').dtype == np.float32)
+    assert (np.array_equal(c.column('frame'), r.column('frame')))
+    assert (np.allclose(c.values, r.values, rtol=1e-6))
+    assert (c.values is c.values)
+    assert (c._store.nbytes < 0.6 * (r.points.nbytes + r.values.nbytes))
+    assert ([name for name, _ in c.point_data()] == c.value_names)
+    assert (c.point_data(['frame'])[0][1] is c.column('frame'))
+
+
+def test_thunderstorm_projection():
+    with tempfile.TemporaryDirectory() as indir:
+        fname, data = write_thunderstorm(indir)
+        r = t.ThunderstormReader(fname, columns=['frame', 'intensity [photon]'])
+        chunks = list(t.ThunderstormReader(fname, columns=['frame'], lazy=True).iter_chunks(40))
+    assert (r.value_names == ['frame', 'intensity [photon]'])
+    assert (r.values.shape == (len(data), 2))
+    assert (np.allclose(r.values[:, 1], data['intensity [photon]'].values))
+    assert (np.array_equal(np.vstack([v for _, v in chunks])[:, 0], r.values[:, 0]))
+
+
+def test_frames_sorted():
+    with tempfile.TemporaryDirectory() as indir:
+        fname, data = write_thunderstorm(indir)
+        r = t.ThunderstormReader(fname)
+        points, values = r.frames(3, 6)
+        assert (os.path.isfile(fname + '.frameindex.npz') is False)
+        r.frame_index(persist=True)
+        assert (t.ThunderstormReader(fname).frame_index(persist=True).sorted)
+        assert (os.path.isfile(fname + '.frameindex.npz'))
+    mask = (data['frame'] >= 3) & (data['frame'] < 6)
+    assert (np.shares_memory(points, r.points))
+    assert (np.array_equal(values, r.values[mask.values]))
+
+
+def test_frames_unsorted():
+    A = np.random.RandomState(0).uniform(0, 100, (50, 8))
+    A[:, -1] = np.random.RandomState(1).randint(0, 10, 50)
+    with tempfile.TemporaryDirectory() as indir:
+        fname = os.path.join(indir, 'test.3dlp')
+        np.savetxt(fname, A)
+        r = d.DlpReader(fname, compact=True)
+        points, values = r.frames(2, 5)
+    mask = (A[:, -1] >= 2) & (A[:, -1] < 5)
+    assert (not r.frame_index().sorted)
+    assert (np.array_equal(values[:, -1], np.sort(A[mask, -1], kind='stable')))
+    assert (len(points) == np.count_nonzero(mask))
@@ -0,0 +1,69 @@
+import smlmvis.vtuwriter as v
+import smlmvis.vtkhdf as h
+from smlmvis.encoding import Encoding, HDFEncoding
+import numpy as np
+import vtk
+from vtk.util.numpy_support import vtk_to_numpy
+import pytest
+import os
+import tempfile
+
+
+def read_steps(filename):
+    reader = vtk.vtkHDFReader()
+    reader.SetFileName(filename)
+    reader.UpdateInformation()
+    steps = reader.GetOutputInformation(0).Get(vtk.vtkStreamingDemandDrivenPipeline.TIME_STEPS()) or []
+    for step in steps:
+        reader.UpdateTimeStep(step)
+        grid = reader.GetOutput()
+        yield step, vtk_to_numpy(grid.GetPoints().GetData()), vtk_to_numpy(grid.GetPointData().GetArray('point_values_array'))
+
+
+def test_temporal_hdf():
+    rng = np.random.default_rng(0)
+    frames = np.sort(rng.integers(1, 30, 400)).astype(float)
+    points = rng.random((400, 3))
+    values = np.column_stack([rng.random(400), frames])
+    with tempfile.TemporaryDirectory() as indir:
+        name = os.path.join(indir, 'series')
+        for incremental in [False, True]:
+            h.TemporalHDFWriter(name, points, values, incremental=incremental, collate_frames=2)
+            windows = v.frame_windows(frames, incremental, 0, 2)
+            steps = list(read_steps(name + '.vtkhdf'))
+            assert len(steps) == len(windows)
+            for (frame, lo, hi), (step, p, val) in zip(windows, steps):
+                assert step == frame
+                assert np.array_equal(p, points[lo:hi].astype(np.float32))
+                assert np.array_equal(val, frames[lo:hi])
+
+
+def read_hdf(filename):
+    reader = vtk.vtkHDFReader()
+    reader.SetFileName(filename)
+    reader.Update()
+    grid = reader.GetOutput()
+    return grid, vtk_to_numpy(grid.GetPoints().GetData()), vtk_to_numpy(grid.GetPointData().GetArray('point_values_array'))
+
+
+def test_hdf_backend():
+    rng = np.random.default_rng(1)
+    points, values = rng.random((1000, 3)), rng.random((1000, 2))
+    with tempfile.TemporaryDirectory() as indir:
+        name = os.path.join(indir, 'cloud')
+        for encoding in [None, HDFEncoding(compression='gzip', level=1, chunk_rows=100, shuffle=True),
+                         HDFEncoding(chunk_rows=7)]:
+            v.VtuWriter(name, points, values, encoding=encoding, backend='hdf')
+            grid, p, val = read_hdf(name + '.vtkhdf')
+            assert np.array_equal(p, points.astype(np.float32))
+            assert np.array_equal(val, values[:, -1])
+            assert grid.GetNumberOfCells() == 1 and grid.GetCell(0).GetNumberOfPoints() == 1000
+        edges = {(0, 600): [(0, 1), (2, 3)]}
+        v.NNWriter(name, [points[:600], points[600:]], [values[:600], values[600:]], [0, 1], edges, backend='hdf')
+        grid, p, val = read_hdf(name + '.vtkhdf')
+        assert np.array_equal(val, np.repeat([0., 1.], [600, 400]))
+        assert grid.GetNumberOfCells() == 4 and list(grid.GetCell(3).GetPointIds().GetId(i) for i in range(2)) == [2, 603]
+        with pytest.raises(ValueError):
+            v.VtuWriter(name, points, values, encoding=Encoding(), backend='hdf')
+        results = v.benchmark_encodings(points, values, backend='hdf', directory=indir)
+        assert len(results) == 3
@@ -1,6 +1,13 @@
 import smlmvis.vtuwriter as v
 import smlmvis.epflreader as e
+import smlmvis.vtkxml as x
+from smlmvis.encoding import Encoding
 import pandas as pd
+import numpy as np
+import scipy.sparse as sp
+import vtk
+from vtk.util.numpy_support import vtk_to_numpy
+import pytest
 import os
 import filecmp
 import urllib
@@ -18,3 +25,295 @@ def test_wrt():
         url2 = 'http://vault.sfu.ca/index.php/s/NMhjJmaAWfw7sAa/download'
         urllib.request.urlretrieve(url2, os.path.join(indir, 'testref.vtu'))
         assert (filecmp.cmp(os.path.join(indir, 'test.vtu'), os.path.join(indir, 'testref.vtu'), shallow=False))
+
+
+def reference_data():
+    reader = vtk.vtkXMLUnstructuredGridReader()
+    reader.SetFileName(os.path.join(os.path.dirname(__file__), '..', 'testdata', 'testref.vtu'))
+    reader.Update()
+    grid = reader.GetOutput()
+    points = vtk_to_numpy(grid.GetPoints().GetData()).astype('float64')
+    values = vtk_to_numpy(grid.GetPointData().GetArray('point_values_array')).reshape(-1, 1)
+    return points, values
+
+
+def test_vtuwriter_reference():
+    points, values = reference_data()
+    ref = os.path.join(os.path.dirname(__file__), '..', 'testdata', 'testref.vtu')
+    with tempfile.TemporaryDirectory() as indir:
+        v.VtuWriter(os.path.join(indir, 'test'), points, values)
+        assert filecmp.cmp(os.path.join(indir, 'test.vtu'), ref, shallow=False)
+        gsd = np.zeros((len(values), 3))
+        gsd[:, 0] = values[:, 0]
+        v.GSDWriter(os.path.join(indir, 'gsd'), points, gsd)
+        assert filecmp.cmp(os.path.join(indir, 'gsd.vtu'), ref, shallow=False)
+
+
+def read_vtu(filename):
+    reader = vtk.vtkXMLUnstructuredGridReader()
+    reader.SetFileName(filename)
+    reader.Update()
+    grid = reader.GetOutput()
+    return vtk_to_numpy(grid.GetPoints().GetData()), vtk_to_numpy(grid.GetPointData().GetArray('point_values_array'))
+
+
+def test_encodings():
+    points, values = reference_data()
+    with tempfile.TemporaryDirectory() as indir:
+        for encoding in [Encoding(raw=True, compressor='none'), Encoding(raw=True, compressor='lz4', block_size=1 << 16),
+                         Encoding(compressor='lzma', level=1), Encoding(data_mode='ascii')]:
+            name = os.path.join(indir, encoding.data_mode + encoding.compressor)
+            v.VtuWriter(name, points, values, encoding=encoding)
+            p, val = read_vtu(name + '.vtu')
+            assert np.array_equal(p, points.astype(np.float32))
+            assert np.allclose(val, values[:, 0])
+        results = v.benchmark_encodings(points, values, directory=indir)
+        assert len(results) == 7 and all(size > 0 for _, _, _, size in results)
+    with pytest.raises(ValueError):
+        Encoding(compressor='gzip')
+    with pytest.raises(ValueError):
+        Encoding(block_size=1001)
+
+
+def test_pvtu():
+    points, values = reference_data()
+    with tempfile.TemporaryDirectory() as indir:
+        for split in ['index', 'spatial']:
+            name = os.path.join(indir, split)
+            v.PVtuWriter(name, points, values, partitions=3, split=split, max_workers=2)
+            assert all(os.path.isfile('{}_{}.vtu'.format(name, i)) for i in range(3))
+            reader = vtk.vtkXMLPUnstructuredGridReader()
+            reader.SetFileName(name + '.pvtu')
+            reader.Update()
+            grid = reader.GetOutput()
+            p = vtk_to_numpy(grid.GetPoints().GetData())
+            val = vtk_to_numpy(grid.GetPointData().GetArray('point_values_array'))
+            assert len(p) == len(points)
+            order = np.lexsort(p.T)
+            ref = np.lexsort(points.astype(np.float32).T)
+            assert np.array_equal(p[order], points.astype(np.float32)[ref])
+            assert np.array_equal(val[order], values[ref, 0])
+
+
+def test_point_data():
+    points, values = reference_data()
+    frames = np.arange(len(points), dtype=np.uint32) // 10 + 1
+    sigma = np.linspace(0, 1, len(points), dtype=np.float32)
+    point_data = [('frame', frames), ('sigma [nm]', sigma)]
+    with tempfile.TemporaryDirectory() as indir:
+        for backend in v.BACKENDS:
+            name = os.path.join(indir, backend)
+            v.VtuWriter(name, points, None, backend=backend, point_data=point_data)
+            reader = vtk.vtkHDFReader() if backend == 'hdf' else vtk.vtkXMLUnstructuredGridReader()
+            reader.SetFileName(name + v.EXTENSIONS[backend])
+            reader.Update()
+            data = reader.GetOutput().GetPointData()
+            assert backend == 'hdf' or data.GetScalars().GetName() == 'frame'
+            assert vtk_to_numpy(data.GetArray('frame')).dtype == np.uint32
+            assert np.array_equal(vtk_to_numpy(data.GetArray('frame')), frames)
+            assert np.array_equal(vtk_to_numpy(data.GetArray('sigma [nm]')), sigma)
+        name = os.path.join(indir, 'pieces')
+        v.PVtuWriter(name, points, values, partitions=2, max_workers=2, point_data=point_data)
+        reader = vtk.vtkXMLPUnstructuredGridReader()
+        reader.SetFileName(name + '.pvtu')
+        reader.Update()
+        data = reader.GetOutput().GetPointData()
+        assert data.GetScalars().GetName() == 'point_values_array'
+        assert np.array_equal(np.sort(vtk_to_numpy(data.GetArray('frame'))), frames)
+        v.TemporalVtuWriter(os.path.join(indir, 'frame'), points, frames.reshape(-1, 1), max_workers=2,
+                            point_data=point_data)
+        p, val = read_vtu(os.path.join(indir, 'frame2.vtu'))
+        assert np.array_equal(val, frames[frames == 2])
+
+
+def test_nn_edges():
+    points, values = reference_data()
+    pointset = [points[:50], points[50:50], points[50:80]]
+    valueset = [values[:50], values[50:50], values[50:80]]
+    offsets = v.channel_offsets(pointset)
+    assert offsets.tolist() == [0, 50, 50]
+    edges = {(offsets[0], offsets[2]): np.array([[0, 1], [3, 4]]), (offsets[2], offsets[0]): [(2, 5)]}
+    with tempfile.TemporaryDirectory() as indir:
+        v.NNWriter(os.path.join(indir, 'dict'), pointset, valueset, [0, 1, 2], edges)
+        v.NNWriter(os.path.join(indir, 'array'), pointset, valueset, [0, 1, 2], [[0, 51], [3, 54], [52, 5]])
+        assert filecmp.cmp(os.path.join(indir, 'dict.vtu'), os.path.join(indir, 'array.vtu'), shallow=False)
+        p, val = read_vtu(os.path.join(indir, 'dict.vtu'))
+        assert val.tolist() == [0] * 50 + [2] * 30
+
+
+def test_mat_writer():
+    mat = np.arange(12.).reshape(3, 4)
+    with tempfile.TemporaryDirectory() as indir:
+        for backend in v.BACKENDS:
+            name = os.path.join(indir, backend)
+            v.MatWriter(name, mat, backend=backend)
+            reader = vtk.vtkHDFReader() if backend == 'hdf' else vtk.vtkXMLImageDataReader()
+            reader.SetFileName(name + v.IMAGE_EXTENSIONS[backend])
+            reader.Update()
+            image = reader.GetOutput()
+            assert np.array_equal(vtk_to_numpy(image.GetPointData().GetArray('point_values_array')), mat.ravel())
+            # [i, j] at (n - i, j)
+            assert image.GetPoint(6) == (2, 2, 0)
+        sparse = sp.dok_matrix((6, 6))
+        sparse[1, 2] = 3
+        sparse[4, 0] = 7
+        v.MatWriter(os.path.join(indir, 'sparse'), sparse.tocsr())
+        p, val = read_vtu(os.path.join(indir, 'sparse.vtu'))
+        assert sorted(zip(p[:, 0], p[:, 1], val)) == [(2, 0, 7), (5, 2, 3)]
+
+
+def test_tetra_mesh():
+    reader = vtk.vtkXMLUnstructuredGridReader()
+    reader.SetFileName(os.path.join(os.path.dirname(__file__), '..', 'testdata', 'alpha.vtu'))
+    reader.Update()
+    grid = reader.GetOutput()
+    points = vtk_to_numpy(grid.GetPoints().GetData()).astype(np.float64)
+    values = vtk_to_numpy(grid.GetPointData().GetArray('point_values_array'))
+    cells = vtk_to_numpy(grid.GetCells().GetConnectivityArray())
+    tetras = cells[len(points):].reshape(-1, 4)
+    with tempfile.TemporaryDirectory() as indir:
+        name = os.path.join(indir, 'alpha')
+        v.AlphaGraphWriter(name, points, values, tetras)
+        reader.SetFileName(name + '.vtu')
+        reader.Update()
+        assert np.array_equal(vtk_to_numpy(reader.GetOutput().GetCells().GetConnectivityArray()), cells)
+        # Only the first 10 tetras, with their volume as cell data
+        volume = np.abs(np.linalg.det(points[tetras[:10, 1:]] - points[tetras[:10, :1]])) / 6
+        for backend in v.BACKENDS:
+            name = os.path.join(indir, backend)
+            v.TetraMeshWriter(name, points, tetras[:10], values, cell_data=[('volume', volume)], drop_unused=True,
+                              backend=backend)
+            reader = vtk.vtkHDFReader() if backend == 'hdf' else vtk.vtkXMLUnstructuredGridReader()
+            reader.SetFileName(name + v.EXTENSIONS[backend])
+            reader.Update()
+            mesh = reader.GetOutput()
+            used = np.unique(tetras[:10])
+            assert mesh.GetNumberOfPoints() == len(used)
+            assert np.array_equal(vtk_to_numpy(mesh.GetPointData().GetArray('point_values_array')), values[used])
+            assert np.array_equal(vtk_to_numpy(mesh.GetCellData().GetArray('volume')), volume)
+            connectivity = vtk_to_numpy(mesh.GetCells().GetConnectivityArray()).reshape(-1, 4)
+            assert np.array_equal(used[connectivity], tetras[:10])
+
+
+def test_numpy_backend():
+    points, values = reference_data()
+    values = np.column_stack([np.arange(len(values)), values])
+    with tempfile.TemporaryDirectory() as indir:
+        for encoding in [Encoding(), Encoding(raw=True, compressor='none'), Encoding(compressor='none'),
+                         Encoding(raw=True, compressor='lzma', level=1, block_size=1000)]:
+            name = os.path.join(indir, 'numpy')
+            v.VtuWriter(name, points, values, encoding=encoding, backend='numpy')
+            p, val = read_vtu(name + '.vtu')
+            assert np.array_equal(p, points.astype(np.float32))
+            assert np.array_equal(val, values[:, -1])
+        tetras = np.array([[0, 1, 2, 3], [1, 2, 3, 4]])
+        for backend in v.BACKENDS:
+            v.GraphWriter(os.path.join(indir, backend), points[:5], values[:5, 0], tetras, backend=backend)
+        assert read_vtu(os.path.join(indir, 'vtk.vtu'))[1].tolist() == read_vtu(os.path.join(indir, 'numpy.vtu'))[1].tolist()
+
+
+def test_polydata():
+    points, values = reference_data()
+    a, b = points[:50], points[50:80]
+    edges = {(0, 50): [(0, 1), (3, 4)], (50, 0): [(2, 5)]}
+    with tempfile.TemporaryDirectory() as indir:
+        for backend in v.BACKENDS:
+            name = os.path.join(indir, backend)
+            v.NNWriter(name, [a, b], [values[:50], values[50:80]], [0, 1], edges, backend=backend, polydata=True)
+            reader = vtk.vtkHDFReader() if backend == 'hdf' else vtk.vtkXMLPolyDataReader()
+            reader.SetFileName(name + v.POLYDATA_EXTENSIONS[backend])
+            reader.Update()
+            poly = reader.GetOutput()
+            assert poly.GetNumberOfVerts() == 80
+            assert np.array_equal(vtk_to_numpy(poly.GetPoints().GetData()), points[:80].astype(np.float32))
+            assert vtk_to_numpy(poly.GetLines().GetConnectivityArray()).tolist() == [0, 51, 3, 54, 52, 5]
+            assert vtk_to_numpy(poly.GetPointData().GetArray('point_values_array')).tolist() == [0] * 50 + [1] * 30
+
+
+def test_append_writer():
+    points, values = reference_data()
+    with tempfile.TemporaryDirectory() as indir:
+        name = os.path.join(indir, 'append')
+        for encoding in [Encoding(raw=True, compressor='none'), Encoding(), Encoding(compressor='none')]:
+            with v.AppendVtuWriter(name, encoding) as writer:
+                for start in range(0, len(points), 1000):
+                    writer.append(points[start:start + 1000], values[start:start + 1000])
+            p, val = read_vtu(name + '.vtu')
+            assert np.array_equal(p, points.astype(np.float32))
+            assert np.array_equal(val, values[:, 0])
+            assert os.listdir(indir) == ['append.vtu']
+        with v.AppendVtuWriter(name):
+            pass
+        p, val = read_vtu(name + '.vtu')
+        assert len(p) == 0 and len(val) == 0
+
+
+def test_append_writer_failed_open():
+    points, values = reference_data()
+    with tempfile.TemporaryDirectory() as indir:
+        name = os.path.join(indir, 'append')
+        lz4, x.lz4 = x.lz4, None
+        try:
+            try:
+                v.AppendVtuWriter(name, Encoding(compressor='lz4'))
+                assert False
+            except ImportError:
+                pass
+        finally:
+            x.lz4 = lz4
+        assert os.listdir(indir) == []
+        writer = v.AppendVtuWriter(name)
+        encoder, x._ArrayEncoder = x._ArrayEncoder, None
+        try:
+            try:
+                writer.open()
+                assert False
+            except TypeError:
+                pass
+        finally:
+            x._ArrayEncoder = encoder
+        assert os.listdir(indir) == []
+        with writer:
+            writer.append(points, values)
+        assert len(read_vtu(name + '.vtu')[0]) == len(points)
+
+def loop_windows(filename, values, incremental, limit, skip):
+    # Frame splitting as TemporalVtuWriter did it, one row at a time
+    windows, lastframe, lastindex = [], 1, 0
+    for index, value in enumerate(values):
+        fnumber = int(value[-1])
+        if fnumber > lastframe + skip - 1:
+            windows.append(("{}{}".format(filename, fnumber - 1), 0 if incremental else lastindex, index))
+            lastframe, lastindex = fnumber, index
+            if limit != 0 and fnumber > limit:
+                break
+    return windows
+
+
+def test_temporal_windows():
+    rng = np.random.default_rng(0)
+    sorted_frames = np.sort(rng.integers(1, 60, 500)).astype(float)
+    unsorted_frames = rng.integers(1, 60, 500).astype(float)
+    with tempfile.TemporaryDirectory() as indir:
+        name = os.path.join(indir, 'frame')
+        for frames in [sorted_frames, unsorted_frames, np.ones(10), np.empty(0)]:
+            values = np.column_stack([rng.random(len(frames)), frames])
+            for incremental, limit, skip in [(False, 0, 1), (True, 0, 1), (False, 20, 3), (True, 7, 5)]:
+                windows = [("{}{}".format(name, frame), lo, hi) for frame, lo, hi in
+                           v.frame_windows(values[:, -1], incremental, limit, skip)]
+                assert windows == loop_windows(name, values, incremental, limit, skip)
+        points = rng.random((500, 3))
+        values = np.column_stack([rng.random(500), sorted_frames])
+        v.TemporalVtuWriter(name, points, values, limit=20, collate_frames=3, max_workers=2)
+        windows = loop_windows(name, values, False, 20, 3)
+        assert sorted(os.listdir(indir)) == sorted(os.path.basename(w[0]) + '.vtu' for w in windows)
+        for sfname, lo, hi in windows:
+            p, val = read_vtu(sfname + '.vtu')
+            assert np.array_equal(val, values[lo:hi, -1])
+        serial = os.path.join(indir, 'serial')
+        os.mkdir(serial)
+        v.TemporalVtuWriter(os.path.join(serial, 'frame'), points, values, limit=20, collate_frames=3)
+        for sfname, _, _ in windows:
+            other = os.path.join(serial, os.path.basename(sfname)) + '.vtu'
+            with open(sfname + '.vtu', 'rb') as a, open(other, 'rb') as b:
+                assert a.read() == b.read()